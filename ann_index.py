@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Inverted-file (IVF) approximate nearest-neighbor index for chunk vectors, in NumPy
+Vectors are grouped around `nlist` coarse centroids learned with spherical k-means.
+A query is compared with the centroids first and then only with the vectors of its
+`nprobe` closest lists, so it scans roughly nprobe / nlist of the corpus instead of
+all of it. Raising nprobe trades latency for recall (nprobe == nlist is exact search).
+Each list keeps its vectors in one contiguous float32 block. The index can be saved
+to and loaded from a single .npz file. benchmark_ann.py measures recall and latency.
+"""
+import math
+import os
+
+import numpy as np
+
+DEFAULT_NPROBE = 8
+KMEANS_ITERATIONS = 10
+TRAIN_POINTS_PER_LIST = 64  # k-means runs on a sample of at most nlist * this many vectors
+ASSIGN_BLOCK = 16384  # Vectors assigned to centroids per matrix product
+
+
+def default_nlist(count):
+    """About sqrt(n) lists: balances centroid scoring against list scanning"""
+    return max(1, int(math.sqrt(count)))
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def _nearest(vectors, centroids):
+    """Index of the most similar centroid for each vector, computed block by block"""
+    assignment = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK):
+        block = vectors[start:start + ASSIGN_BLOCK]
+        assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignment
+
+
+class IvfIndex:
+    """Cosine-similarity IVF index over unit-length float32 vectors"""
+
+    def __init__(self, dimension, nlist=None, nprobe=DEFAULT_NPROBE, seed=0):
+        self.dimension = dimension
+        self.nlist = nlist  # Chosen from the training set size when None
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self._vectors = []  # per list: (capacity, dimension) block
+        self._ids = []  # per list: ids of its live rows
+        self._where = {}  # id -> (list, row)
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, item_id):
+        return item_id in self._where
+
+    def train(self, vectors, iterations=KMEANS_ITERATIONS):
+        """Learn the coarse centroids with spherical k-means on (a sample of) the vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        if not len(vectors):
+            raise ValueError("IvfIndex.train needs at least one vector")
+        rng = np.random.default_rng(self.seed)
+        nlist = min(self.nlist or default_nlist(len(vectors)), len(vectors))
+        sample_size = min(len(vectors), nlist * TRAIN_POINTS_PER_LIST)
+        sample = vectors[rng.choice(len(vectors), sample_size, replace=False)] \
+            if sample_size < len(vectors) else vectors
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            if empty.any():  # Restart empty lists from random points
+                sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+            centroids = _normalize(sums).astype(np.float32)
+        self.centroids = np.ascontiguousarray(centroids)
+        self.nlist = nlist
+        self._vectors = [np.zeros((0, self.dimension), dtype=np.float32) for _ in range(nlist)]
+        self._ids = [[] for _ in range(nlist)]
+        self._where = {}
+
+    def add(self, ids, vectors):
+        """Add (or replace) vectors; the index must be trained"""
+        if not self.trained:
+            raise RuntimeError("IvfIndex.train must run before add")
+        ids = list(ids)
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        self.remove([item_id for item_id in ids if item_id in self._where])
+        assignment = _nearest(vectors, self.centroids)
+        order = np.argsort(assignment, kind='stable')
+        boundaries = np.searchsorted(assignment[order], np.arange(self.nlist + 1))
+        for list_number in np.flatnonzero(np.diff(boundaries)):
+            members = order[boundaries[list_number]:boundaries[list_number + 1]]
+            self._append(int(list_number), [ids[member] for member in members], vectors[members])
+
+    def _append(self, list_number, ids, vectors):
+        block = self._vectors[list_number]
+        size = len(self._ids[list_number])
+        needed = size + len(ids)
+        if needed > len(block):
+            grown = np.zeros((max(needed, 2 * len(block), 16), self.dimension), dtype=np.float32)
+            grown[:size] = block[:size]
+            self._vectors[list_number] = block = grown
+        block[size:needed] = vectors
+        for offset, item_id in enumerate(ids):
+            self._where[item_id] = (list_number, size + offset)
+        self._ids[list_number].extend(ids)
+
+    def remove(self, ids):
+        """Drop vectors by id; the last row of their list moves into the gap"""
+        for item_id in ids:
+            location = self._where.pop(item_id, None)
+            if location is None:
+                continue
+            list_number, row = location
+            list_ids, block = self._ids[list_number], self._vectors[list_number]
+            last = len(list_ids) - 1
+            if row != last:
+                moved = list_ids[last]
+                block[row] = block[last]
+                list_ids[row] = moved
+                self._where[moved] = (list_number, row)
+            list_ids.pop()
+
+    def search(self, queries, k=10, nprobe=None):
+        """For each query vector, the k best (id, cosine) pairs found in its nprobe closest lists"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        if not self.trained or not len(self._where):
+            return [[] for _ in range(len(queries))]
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        centroid_scores = queries @ self.centroids.T
+        if nprobe < self.nlist:
+            probes = np.argpartition(-centroid_scores, nprobe - 1, axis=1)[:, :nprobe]
+        else:
+            probes = np.broadcast_to(np.arange(self.nlist), centroid_scores.shape)
+
+        results = []
+        for query, lists in zip(queries, probes):
+            scores, owners = [], []
+            for list_number in lists:
+                size = len(self._ids[list_number])
+                if size:
+                    scores.append(self._vectors[list_number][:size] @ query)
+                    owners.append((list_number, size))
+            if not scores:
+                results.append([])
+                continue
+            scores = np.concatenate(scores)
+            top = min(k, len(scores))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            # Map positions in the concatenated scores back to (list, row) -> id
+            starts = np.cumsum([0] + [size for _, size in owners])
+            hits = []
+            for position in best:
+                owner = int(np.searchsorted(starts, position, side='right')) - 1
+                list_number = owners[owner][0]
+                hits.append((self._ids[list_number][position - starts[owner]], float(scores[position])))
+            results.append(hits)
+        return results
+
+    def save(self, path):
+        """Write centroids, vectors and ids to one .npz file (atomically)"""
+        sizes = np.array([len(list_ids) for list_ids in self._ids], dtype=np.int64)
+        vectors = np.concatenate([block[:size] for block, size in zip(self._vectors, sizes)]) \
+            if len(sizes) else np.zeros((0, self.dimension), dtype=np.float32)
+        ids = np.array([item_id for list_ids in self._ids for item_id in list_ids])
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.savez(f, centroids=self.centroids, vectors=vectors, sizes=sizes, ids=ids,
+                     settings=np.array([self.dimension, self.nlist, self.nprobe, self.seed], dtype=np.int64))
+        os.replace(temp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            dimension, nlist, nprobe, seed = (int(value) for value in data['settings'])
+            index = cls(dimension, nlist, nprobe, seed)
+            index.centroids = np.ascontiguousarray(data['centroids'])
+            vectors, ids, sizes = data['vectors'], data['ids'].tolist(), data['sizes']
+        index._vectors, index._ids = [], []
+        start = 0
+        for list_number, size in enumerate(sizes):
+            size = int(size)
+            index._vectors.append(np.ascontiguousarray(vectors[start:start + size]))
+            index._ids.append(ids[start:start + size])
+            for row, item_id in enumerate(index._ids[-1]):
+                index._where[item_id] = (list_number, row)
+            start += size
+        return index
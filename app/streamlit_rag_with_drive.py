@@ -1,13 +1,22 @@
 import os
-import io
-import fitz  # PyMuPDF
-from docx import Document as DocxDoc
+import sys
+import time
 import streamlit as st
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-from google.auth.transport.requests import Request
 from datetime import datetime
 
+# Shared modules (text cache, Drive pool etc.) live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from text_cache import text_cache, file_version
+from drive_service import DriveServicePool
+from drive_batch import batch_list
+from drive_throttle import drive_throttle
+from single_flight import drive_downloads
+from document_text import document_kind
+from extraction_pool import ExtractionRejected, extraction_pool, limit_hit
+from drive_download import GOOGLE_EXPORTS, download_to_path, downloaded_file, exported_file
+from sheet_store import sheet_store
+from folder_index import FolderSnapshot, stream_folders
+
 # Config
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 DOCS_DIR = "docs"
@@ -194,69 +203,64 @@ st.markdown("""
 """, unsafe_allow_html=True)
 
 # Authentication function
+def load_google_credentials():
+    """Build Google Drive credentials from Streamlit secrets"""
+    from google.oauth2.credentials import Credentials
+    
+    # Create credentials from Streamlit secrets
+    creds_info = {
+        "client_id": st.secrets["google"]["client_id"],
+        "client_secret": st.secrets["google"]["client_secret"],
+        "refresh_token": st.secrets["google"]["refresh_token"],
+        "token": st.secrets["google"]["token"],
+        "token_uri": st.secrets["google"]["token_uri"],
+    }
+    
+    return Credentials.from_authorized_user_info(creds_info, SCOPES)
+
+@st.cache_resource
+def get_drive_pool():
+    """One Drive service pool per server process, shared by every browser session"""
+    # Every Drive call goes through the shared rate limiter, backoff and circuit breaker
+    return DriveServicePool(load_google_credentials, throttle=drive_throttle)
+
 def authenticate_gdrive():
-    """Authenticate with Google Drive using Streamlit secrets"""
+    """Return this script thread's pooled Google Drive service"""
     try:
-        from google.oauth2.credentials import Credentials
-        
-        # Create credentials from Streamlit secrets
-        creds_info = {
-            "client_id": st.secrets["google"]["client_id"],
-            "client_secret": st.secrets["google"]["client_secret"],
-            "refresh_token": st.secrets["google"]["refresh_token"],
-            "token": st.secrets["google"]["token"],
-            "token_uri": st.secrets["google"]["token_uri"],
-        }
-        
-        # Create credentials object
-        creds = Credentials.from_authorized_user_info(creds_info, SCOPES)
-        
-        # Refresh if needed
-        if creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        
-        # Build and return the service
-        return build('drive', 'v3', credentials=creds)
+        return get_drive_pool().get()
         
     except Exception as e:
         st.error(f"🚫 Authentication failed: {str(e)}")
         return None
 
-def get_all_folders_recursive(service, parent_id, parent_path=""):
-    """Get ALL folders - no limits, full depth for business use"""
-    folders = []
-    
-    try:
-        query = f"'{parent_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        results = service.files().list(q=query, fields="files(id, name)", pageSize=1000).execute()
-        items = results.get("files", [])
+ROOT_FOLDER_ID = "1galnuNa9g7xoULx3Ka8vs79-NuJUA4n6"  # WMA RAG folder
+FOLDER_POLL_SECONDS = 2  # Rerun interval while the first folder crawl is still running
 
-        for item in items:
-            full_path = f"{parent_path}/{item['name']}".strip("/")
-            folders.append({
-                "id": item["id"],
-                "name": item["name"],
-                "full_path": full_path
-            })
-            
-            # FULL RECURSION - No limits for business requirements
-            subfolders = get_all_folders_recursive(service, item["id"], full_path)
-            folders.extend(subfolders)
-                
-    except Exception as e:
-        st.error(f"Error accessing folder {parent_path}: {str(e)}")
-    
-    return folders
+@st.cache_resource
+def get_folder_snapshot(root_id):
+    """ALL folders under the root - one shared list for every session, refreshed in the background"""
+    # FULL RECURSION - levels crawled breadth-first with concurrent multi-parent queries, streamed in
+    return FolderSnapshot(lambda: stream_folders(get_drive_pool().get, root_id), max_age=1200)
+
+def folder_selectbox(label, options, key):
+    """A folder picker step whose choice survives reruns that add options while the crawl loads"""
+    # A selectbox whose options change is a new widget that starts at its first option, so the
+    # session remembers the choice and passes it back as the default
+    remembered = st.session_state.get(f"{key}_choice")
+    choice = st.selectbox(label, options, index=options.index(remembered) if remembered in options else 0,
+                          key=key, label_visibility="visible")
+    st.session_state[f"{key}_choice"] = choice
+    return choice
 
 def list_files(service, folder_id):
     """List files in a specific folder"""
     try:
-        results = service.files().list(
-            q=f"'{folder_id}' in parents and trashed=false",
-            fields="files(id, name, mimeType, modifiedTime, size)"
-        ).execute()
-        files = results.get('files', [])
-        return files
+        # Goes through the batch helper so every page is returned, not just the first 100 files
+        return batch_list(
+            service,
+            [f"'{folder_id}' in parents and trashed=false"],
+            fields="nextPageToken, files(id, name, mimeType, modifiedTime, md5Checksum, size)"
+        )[0]
     except Exception as e:
         st.error(f"Error listing files: {str(e)}")
         return []
@@ -264,103 +268,81 @@ def list_files(service, folder_id):
 def download_file(service, file_id, name):
     """Download a file from Google Drive"""
     try:
-        request = service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-            _, done = downloader.next_chunk()
-        path = os.path.join(DOCS_DIR, name)
-        with open(path, 'wb') as f:
-            f.write(fh.getvalue())
-        return path
+        # Chunks go straight to disk instead of through an in-memory buffer
+        return download_to_path(service, file_id, os.path.join(DOCS_DIR, name))
     except Exception as e:
         st.error(f"Error downloading file: {str(e)}")
         return None
 
-def extract_text_from_file(service, file_id, file_name):
-    """Extract text content from a Google Drive file"""
+def extract_text_from_file(service, file_id, file_name, version=None, mime_type=None, size=None):
+    """Extract text content from a Google Drive file, reusing cached text for unchanged revisions"""
+    cached = text_cache.get(file_id, version)
+    if cached is not None:
+        return cached
+    
+    # Sessions asking for the same revision at the same time share one download
+    return drive_downloads.do((file_id, version), download_and_cache_text, service, file_id, file_name, version,
+                              mime_type, size)
+
+def download_and_cache_text(service, file_id, file_name, version, mime_type=None, size=None):
+    """Download and extract one file revision into the shared text cache"""
+    # Another session may have just finished extracting this revision
+    cached = text_cache.get(file_id, version)
+    if cached is not None:
+        return cached
+    
+    # Revisions that broke the extraction limits are not downloaded again
+    reason = text_cache.quarantined(file_id, version)
+    if reason:
+        return f"Error extracting text: skipped ({reason})"
+    
     try:
-        # Download the file
-        request = service.files().get_media(fileId=file_id)
-        fh = io.BytesIO()
-        downloader = MediaIoBaseDownload(fh, request)
-        done = False
-        while not done:
-               _, done = downloader.next_chunk()
-        
-        # Extract text based on file type
-        file_content = fh.getvalue()
-        
-        if file_name.lower().endswith('.pdf'):
-            # Extract text from PDF
-            pdf_doc = fitz.open(stream=file_content, filetype="pdf")
-            text = ""
-            for page in pdf_doc:
-                text += page.get_text() + "\n"
-            pdf_doc.close()
-            return text
-            
-        elif file_name.lower().endswith('.docx'):
-            # Extract text from Word document
-            doc = DocxDoc(io.BytesIO(file_content))
-            text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
-            return text
-            
-        elif file_name.lower().endswith('.txt'):
-            # Extract text from text file
-            return file_content.decode('utf-8')
-            
-        elif file_name.lower().endswith(('.xlsx', '.xls')):
-            # Extract readable summary from Excel file
-            import pandas as pd
-            
-            try:
-                # Read Excel file
-                excel_file = pd.ExcelFile(io.BytesIO(file_content))
-                summary_parts = []
-                
-                summary_parts.append(f"Excel File: {file_name}")
-                summary_parts.append(f"Number of sheets: {len(excel_file.sheet_names)}")
-                summary_parts.append("Sheet contents:")
-                
-                # Process each sheet (limit to first 3 sheets for mobile)
-                for i, sheet_name in enumerate(excel_file.sheet_names[:3]):
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                    
-                    summary_parts.append(f"\nSheet '{sheet_name}':")
-                    summary_parts.append(f"  - {df.shape[0]} rows, {df.shape[1]} columns")
-                    
-                    # Add column names
-                    if len(df.columns) > 0:
-                        columns = list(df.columns)[:5]  # First 5 columns
-                        summary_parts.append(f"  - Columns: {', '.join(str(col) for col in columns)}")
-                        if len(df.columns) > 5:
-                            summary_parts.append(f"    ... and {len(df.columns) - 5} more columns")
-                    
-                    # Add sample data from first few rows
-                    if not df.empty:
-                        summary_parts.append("  - Sample data:")
-                        for idx, row in df.head(3).iterrows():
-                            row_summary = []
-                            for col in df.columns[:3]:  # First 3 columns only
-                                value = str(row[col])[:30]  # Truncate long values
-                                if len(str(row[col])) > 30:
-                                    value += "..."
-                                row_summary.append(f"{col}: {value}")
-                            summary_parts.append(f"    Row {idx + 1}: {', '.join(row_summary)}")
-                
-                if len(excel_file.sheet_names) > 3:
-                    summary_parts.append(f"\n... and {len(excel_file.sheet_names) - 3} more sheets")
-                
-                return "\n".join(summary_parts)
-                
-            except Exception as excel_error:
-                return f"Excel file detected but could not be processed: {str(excel_error)}"
-        
+        text = download_and_extract_text(service, file_id, file_name, version, mime_type, size)
+    except ExtractionRejected as e:
+        text_cache.quarantine(file_id, version, e.reason)
+        return f"Error extracting text: {e.reason}"
+    # Download/parse failures are reported as text - never cache those
+    if not text.startswith("Error extracting text"):
+        limit = limit_hit(text)
+        if limit:
+            text_cache.quarantine(file_id, version, f"partial text ({limit} limit)")
+        text_cache.put(file_id, version, text)
+    return text
+
+def download_and_extract_text(service, file_id, file_name, version=None, mime_type=None, size=None):
+    """Download a Google Drive file and extract its text content (spreadsheets also go to the sheet store)"""
+    try:
+        # Native Google Docs/Slides/Sheets are exported - there is nothing to download
+        export = GOOGLE_EXPORTS.get(mime_type)
+        if export:
+            export_mime_type, kind = export
+            source = exported_file(service, file_id, export_mime_type, suffix=f".{kind}")
         else:
-            return "Text extraction not supported for this file type."
+            # Extract text based on file type - parsed in the shared extraction worker processes
+            kind = document_kind(mime_type, file_name)
+            if not kind:
+                return "Text extraction not supported for this file type."
+            # Files over the size limit are rejected before any bytes are downloaded
+            extraction_pool.check_size(size)
+            # Download the file to disk in chunks; the parser opens it by path
+            source = downloaded_file(service, file_id, suffix=f".{kind}")
+        
+        with source as path:
+            if kind == 'pdf':
+                return extraction_pool.parse(path, kind, file_name, separator="\n")
+            if kind == 'xlsx' and sheet_store.available and sheet_store.get(file_id, version) is None:
+                # Text and tables come from the same worker, under the same time and memory limits
+                text, tables = extraction_pool.parse_workbook(path, file_name)
+                if tables is not None:
+                    try:
+                        sheet_store.put(file_id, version, tables)
+                    except Exception as e:
+                        print(f"[SHEET STORE] Could not store tables for {file_name}: {e}")
+                return text
+            return extraction_pool.parse(path, kind, file_name)
             
+    except ExtractionRejected:
+        raise  # Quarantined by the caller, which knows the revision
     except Exception as e:
         return f"Error extracting text: {str(e)}"
 
@@ -458,7 +440,8 @@ def process_voice_command(docs, service):
                 
                 # Real document summary
                 with st.spinner(f"Analyzing {doc_name}..."):
-                    file_text = extract_text_from_file(service, target_doc['id'], doc_name)
+                    file_text = extract_text_from_file(service, target_doc['id'], doc_name, file_version(target_doc),
+                                                       target_doc.get('mimeType'), target_doc.get('size'))
                     if file_text and not file_text.startswith("Error"):
                         summary = generate_summary(file_text)
                         st.info(f"📋 **Summary of {doc_name}:**\n\n{summary}")
@@ -484,7 +467,8 @@ def process_voice_command(docs, service):
                 st.markdown("### 🔊 Auto-Reading Document")
                 
                 with st.spinner(f"Extracting text from {doc_name}..."):
-                    file_text = extract_text_from_file(service, target_doc['id'], doc_name)
+                    file_text = extract_text_from_file(service, target_doc['id'], doc_name, file_version(target_doc),
+                                                       target_doc.get('mimeType'), target_doc.get('size'))
                     if file_text and not file_text.startswith("Error"):
                         # Truncate for speech
                         speech_text = smart_text_truncate(file_text, 600)
@@ -600,9 +584,8 @@ with col2:
 
 # Add clear folder cache button for troubleshooting
 if st.button("🔄 Clear Cache & Reload Folders"):
-    st.session_state.all_folders = None
-    st.session_state.folder_cache_time = None
-    st.rerun()
+    if get_folder_snapshot(ROOT_FOLDER_ID).refresh_async():
+        st.info("📁 Reloading folders in the background - the current list stays available meanwhile")
 
 # Voice input with enhanced voice command processing
 st.markdown("### 🎤 Voice Commands")
@@ -681,11 +664,7 @@ filename_query = st.text_input(
 # Use the combined search query
 active_query = voice_input if voice_input else filename_query
 
-# Initialize session state for caching
-if 'all_folders' not in st.session_state:
-    st.session_state.all_folders = None
-if 'folder_cache_time' not in st.session_state:
-    st.session_state.folder_cache_time = None
+# Initialize session state
 if 'current_step' not in st.session_state:
     st.session_state.current_step = 1
 if 'selected_folder_id' not in st.session_state:
@@ -707,32 +686,33 @@ except Exception as e:
     service = None
 
 # Google Drive folder setup
-root_id = "1galnuNa9g7xoULx3Ka8vs79-NuJUA4n6"  # Your root folder ID
+root_id = ROOT_FOLDER_ID  # Your root folder ID
 all_folders = []
 docs = []
+folders_loading = False
 
 if service:
-    # Get all folders (with smart caching)
+    # Get all folders (shared across sessions, refreshed every 20 minutes without blocking)
     try:
         docs = []  # Initialize as empty list
 
-        # Check if we need to refresh cache (20 minute expiry - balance between freshness and load time)
-        import time
-        current_time = time.time()
-        cache_expired = (
-            st.session_state.folder_cache_time is None or 
-            current_time - st.session_state.folder_cache_time > 1200  # 20 minutes - longer cache for full load
-        )
-        
-        if st.session_state.all_folders is None or cache_expired:
-            with st.spinner("📁 Loading complete folder structure (this may take 30-60 seconds for 38 dealers)..."):
-                st.session_state.all_folders = get_all_folders_recursive(service, root_id)
-                st.session_state.folder_cache_time = current_time
-                st.success(f"📁 Complete! Loaded {len(st.session_state.all_folders)} folders from all dealers")
+        folder_snapshot = get_folder_snapshot(root_id)
+        if folder_snapshot.folders is None:
+            # The first crawl runs in the background; the top-level folders arrive with its first
+            # level, so the picker works from the folders found so far and the page reruns to add more
+            folder_snapshot.start()
+            all_folders = list(folder_snapshot.partial)
+            folders_loading = folder_snapshot.loading
+            if folders_loading:
+                latest = f" - latest: {all_folders[-1]['full_path']}" if all_folders else ""
+                st.info(f"📁 Loading complete folder structure... {len(all_folders)} folders so far{latest}")
+            elif folder_snapshot.folders is not None:
+                all_folders = folder_snapshot.folders
+                st.success(f"📁 Complete! Loaded {len(all_folders)} folders from all dealers")
         else:
-            st.info(f"📁 Using cached structure ({len(st.session_state.all_folders)} folders) - Refreshes every 20 minutes")
-            
-        all_folders = st.session_state.all_folders
+            all_folders = folder_snapshot.get()
+            refreshing = " - refreshing in the background" if folder_snapshot.refreshing else ""
+            st.info(f"📁 Using shared structure ({len(all_folders)} folders, {int(folder_snapshot.age // 60)} min old){refreshing}")
         
         if all_folders:
             st.success(f"📁 Ready! {len(all_folders)} folders available")
@@ -766,6 +746,7 @@ if service:
                 ["Aaron", "Brody", "Dona", "Eric", "Grace", "Jeff", "Jessica", "Jill", "John", "Jon", "Kirk", "Owen", "Paul"],
                 label_visibility="visible"
             )
+            drive_throttle.set_user(user_identity)  # Per-user Drive quota for this session's calls
             
             st.markdown("### 📁 Browse Your Folders")
             
@@ -781,10 +762,10 @@ if service:
                     docs = []
                 else:
                     # Step 1: Select main folder (filtered by user identity)
-                    selected_main_folder = st.selectbox(
+                    selected_main_folder = folder_selectbox(
                         f"**Step 1:** Choose your folder (showing folders for {user_identity})", 
                         accessible_main_folders,
-                        label_visibility="visible"
+                        key="folder_step_1"
                     )
                     
                     # Step 2: Get subfolders for selected main folder (with security check)
@@ -799,10 +780,10 @@ if service:
                             level_1_paths = [f['full_path'] for f in level_1_subfolders]
                             level_1_paths.sort()
                             
-                            selected_level_1 = st.selectbox(
+                            selected_level_1 = folder_selectbox(
                                 "**Step 2:** Choose subfolder", 
                                 level_1_paths,
-                                label_visibility="visible"
+                                key="folder_step_2"
                             )
                             
                             # Step 3: Get level 2 subfolders
@@ -813,10 +794,10 @@ if service:
                                 level_2_paths = [f['full_path'] for f in immediate_level_2]
                                 level_2_paths.sort()
                                 
-                                selected_level_2 = st.selectbox(
+                                selected_level_2 = folder_selectbox(
                                     "**Step 3:** Choose final folder", 
                                     level_2_paths,
-                                    label_visibility="visible"
+                                    key="folder_step_3"
                                 )
                                 
                                 selected_folder = next((f for f in immediate_level_2 if f['full_path'] == selected_level_2), None)
@@ -906,7 +887,8 @@ if docs:
                 # Real document summary
                 if 'id' in doc:
                     with st.spinner(f"Analyzing {doc_name}..."):
-                        file_text = extract_text_from_file(service, doc['id'], doc_name)
+                        file_text = extract_text_from_file(service, doc['id'], doc_name, file_version(doc),
+                                                           doc.get('mimeType'), doc.get('size'))
                         if file_text and not file_text.startswith("Error"):
                             summary = generate_summary(file_text)
                             st.success(f"**📋 AI Summary:** {summary}")
@@ -935,7 +917,8 @@ if docs:
                 # Real document text-to-speech
                 if 'id' in doc:
                     with st.spinner("Extracting text for speech..."):
-                        file_text = extract_text_from_file(service, doc['id'], doc_name)
+                        file_text = extract_text_from_file(service, doc['id'], doc_name, file_version(doc),
+                                                           doc.get('mimeType'), doc.get('size'))
                         if file_text and not file_text.startswith("Error"):
                             # Use smart truncation to end at complete sentences
                             speech_text = smart_text_truncate(file_text, 600)
@@ -1097,3 +1080,8 @@ st.markdown("""
     <small>💡 Tip: Use Chrome or Edge for best voice experience</small>
 </div>
 """, unsafe_allow_html=True)
+
+# Keep filling in the folder picker while the first crawl runs (not while a search is showing results)
+if folders_loading and not active_query:
+    time.sleep(FOLDER_POLL_SECONDS)
+    st.rerun()
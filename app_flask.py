@@ -10,16 +10,26 @@ from werkzeug.security import generate_password_hash, check_password_hash
 from functools import wraps
 import os
 import json
-import io
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timedelta
 from google.oauth2.credentials import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseDownload
-import fitz  # PyMuPDF
-from docx import Document as DocxDoc
 import openai
 from openai import OpenAI
+from text_cache import text_cache, file_version
+from drive_service import DriveServicePool
+from folder_index import FolderIndex, configured_folder_roots
+from drive_sync import DriveMirror
+from drive_batch import batch_list, execute_batch, parents_clauses
+from drive_throttle import drive_throttle
+from single_flight import drive_downloads
+from document_text import PagedText, document_kind, join_segments
+from extraction_pool import ExtractionRejected, extraction_pool, limit_hit
+from drive_download import GOOGLE_EXPORTS, downloaded_file, exported_file
+from sheet_store import SheetQueryError, sheet_store
+from local_corpus import LocalCorpus
+from search_index import ChunkIndex, fuse_rankings, load_stop_words
+from dense_index import DenseRetriever, make_embedder
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'your-secret-key-here-change-in-production')
@@ -66,6 +76,21 @@ for var, value in saved_proxies.items():
 SCOPES = ['https://www.googleapis.com/auth/drive.readonly']
 PARENT_FOLDER_ID = "1galnuNa9g7xoULx3Ka8vs79-NuJUA4n6"  # WMA RAG folder
 
+# Drive fetch/extract worker pool shared by all requests
+DRIVE_WORKERS = int(os.environ.get('DRIVE_WORKERS', 6))
+DRIVE_SEARCH_DEADLINE = float(os.environ.get('DRIVE_SEARCH_DEADLINE', 8))  # seconds per request
+drive_executor = ThreadPoolExecutor(max_workers=DRIVE_WORKERS, thread_name_prefix='drive')
+SEARCH_QUERIES_PER_BATCH = 8  # Folder-chunk queries per batch; batches run in parallel on the pool
+DRIVE_CANDIDATES_PER_GROUP = 3  # Files fetched and extracted per folder group
+LOCAL_DOCS_DIR = os.path.join('app', 'docs')
+LOCAL_SYSTEM_FILES = ('WMA_AI_Agent_System_Prompt.txt', 'WMA_AI_Agent_System_Prompt.docx')  # Never search results
+LOCAL_LOAD_WAIT = 30  # seconds a search waits for the local corpus' first load
+LOCAL_RESULTS = 5  # Best-scoring local documents per query
+SEARCH_TOP_K = 5  # Documents handed to the AI summary, ranked across all sources
+EXCERPT_CHARS = 2500  # Chunk text per document in the AI prompt (the best chunk always goes in)
+DENSE_MIN_SIMILARITY = 0.3  # Cosine below which a dense hit is ignored
+DENSE_WEIGHT = 0.5  # Dense ranking's share in the fusion with BM25 - a BM25 match outranks a dense-only hit
+
 # Load user folder configuration
 SEARCH_CONFIG = {}
 try:
@@ -123,82 +148,143 @@ def get_google_credentials():
     
     return None
 
+# One set of credentials per process, one Drive service per thread, every call rate limited
+drive_pool = DriveServicePool(get_google_credentials, throttle=drive_throttle)
+
 def authenticate_gdrive():
-    """Authenticate and return Google Drive service"""
+    """Return the calling thread's pooled Google Drive service"""
     try:
-        creds = get_google_credentials()
-        if not creds:
-            return None
-            
-        if creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-            
-        return build('drive', 'v3', credentials=creds)
+        return drive_pool.get()
     except Exception as e:
         print(f"Authentication error: {e}")
         return None
 
-def get_subfolders(service, parent_folder_id):
-    """Get all subfolders within a parent folder"""
-    folders = []
+# Folder tree for every configured user/team folder, crawled and refreshed in the background
+folder_index = FolderIndex(
+    authenticate_gdrive,
+    configured_folder_roots(SEARCH_CONFIG),
+    refresh_interval=int(os.environ.get('FOLDER_INDEX_REFRESH', 900))
+)
+
+def search_folder_ids(service, root_ids):
+    """Each root folder plus all of its subfolders - from the folder index, or one batched Drive listing until it is built"""
+    folder_index.start()
+    folder_ids = {root_id: folder_index.descendants(root_id) for root_id in root_ids}
+    missing = [root_id for root_id, descendants in folder_ids.items() if descendants is None]
+    for root_id, subfolders in zip(missing, get_subfolders(service, missing)):
+        folder_ids[root_id] = [root_id] + subfolders
+    return {root_id: list(descendants) for root_id, descendants in folder_ids.items()}
+
+def get_subfolders(service, parent_folder_ids):
+    """Get the direct subfolders of several parent folders in one batched request"""
+    if not parent_folder_ids:
+        return []
     try:
-        query = f"'{parent_folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
-        response = service.files().list(
-            q=query,
-            fields="files(id, name)",
-            pageSize=100
-        ).execute()
-        
-        for folder in response.get('files', []):
-            folders.append(folder['id'])
-            
+        queries = [
+            f"'{parent_folder_id}' in parents and mimeType = 'application/vnd.google-apps.folder' and trashed = false"
+            for parent_folder_id in parent_folder_ids
+        ]
+        return [[folder['id'] for folder in folders] for folders in batch_list(service, queries)]
     except Exception as e:
         print(f"Error getting subfolders: {e}")
+        return [[] for _ in parent_folder_ids]
+
+def extract_text_from_drive_file(file_id, mime_type, service, version=None, size=None):
+    """Extract text content from a Google Drive file, reusing cached text for unchanged revisions"""
+    cached = text_cache.get(file_id, version)
+    if cached is not None:
+        return cached
     
-    return folders
+    try:
+        # Concurrent requests for the same revision share one download
+        return drive_downloads.do((file_id, version), download_and_cache, file_id, mime_type, service, version, size)
+    except Exception as e:
+        print(f"Error extracting text from {file_id}: {e}")
+        return ""
 
-def extract_text_from_drive_file(file_id, mime_type, service):
-    """Extract text content from a Google Drive file"""
+def download_and_cache(file_id, mime_type, service, version, size=None):
+    """Download and extract one file revision into the text cache (run once per in-flight revision)"""
+    # A call that just finished may have filled the cache while this one was queued
+    cached = text_cache.get(file_id, version)
+    if cached is not None:
+        return cached
+    # Revisions that broke the extraction limits before are not downloaded again
+    reason = text_cache.quarantined(file_id, version)
+    if reason:
+        print(f"[EXTRACTION] Skipping quarantined file {file_id}: {reason}")
+        return ""
     try:
-        # Handle Google Docs
-        if mime_type == 'application/vnd.google-apps.document':
+        text = download_and_extract(file_id, mime_type, service, size, version)
+    except ExtractionRejected as e:
+        text_cache.quarantine(file_id, version, e.reason)
+        print(f"[EXTRACTION] Quarantined {file_id}: {e.reason}")
+        return ""
+    limit = limit_hit(text)
+    if limit:
+        # Keep the partial text; the record explains why it is incomplete
+        text_cache.quarantine(file_id, version, f"partial text ({limit} limit)")
+    text_cache.put(file_id, version, text)
+    return text
+
+def download_and_extract(file_id, mime_type, service, size=None, version=None):
+    """Download a Google Drive file and extract its text (no caching, errors propagate)
+
+    Spreadsheets are also stored as columnar tables for /api/sheets queries.
+    """
+    # Native Google files: Docs and Slides export as plain text, Sheets as an XLSX of every sheet
+    export = GOOGLE_EXPORTS.get(mime_type)
+    if export:
+        export_mime_type, kind = export
+        if kind == 'txt':
             result = service.files().export(
                 fileId=file_id,
-                mimeType='text/plain'
+                mimeType=export_mime_type
             ).execute()
-            return result.decode('utf-8')
-        
-        # Handle other files - download and extract
-        request = service.files().get_media(fileId=file_id)
-        file_buffer = io.BytesIO()
-        downloader = MediaIoBaseDownload(file_buffer, request)
-        
-        done = False
-        while not done:
-            status, done = downloader.next_chunk()
-        
-        file_buffer.seek(0)
-        
-        # Extract text based on file type
-        if mime_type == 'application/pdf':
-            pdf_document = fitz.open(stream=file_buffer.read(), filetype="pdf")
-            text = ""
-            for page in pdf_document:
-                text += page.get_text()
-            pdf_document.close()
-            return text
-            
-        elif mime_type in ['application/vnd.openxmlformats-officedocument.wordprocessingml.document']:
-            doc = DocxDoc(file_buffer)
-            return '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-            
-        elif mime_type == 'text/plain':
-            return file_buffer.read().decode('utf-8', errors='ignore')
-            
+            return join_segments(result.decode('utf-8').split('\n'), '\n', unit='paragraph')
+        with exported_file(service, file_id, export_mime_type, suffix=f".{kind}") as path:
+            return parse_downloaded_file(file_id, version, path, kind)
+    
+    # Handle other files - download and extract
+    kind = document_kind(mime_type)
+    if kind not in ('pdf', 'docx', 'txt', 'xlsx'):
+        return ""  # Unsupported type - don't spend the download
+    extraction_pool.check_size(size)
+    # Stream to a temp file and parse it by path in the extraction worker processes
+    with downloaded_file(service, file_id, suffix=f".{kind}") as path:
+        return parse_downloaded_file(file_id, version, path, kind)
+
+def parse_downloaded_file(file_id, version, path, kind):
+    """Text of a downloaded/exported file; workbooks also go to the sheet store"""
+    if kind == 'xlsx' and sheet_store.available and sheet_store.get(file_id, version) is None:
+        # Text and tables come from the same worker, under the same time and memory limits
+        text, tables = extraction_pool.parse_workbook(path)
+        if tables is not None:
+            store_sheet_tables(file_id, version, tables)
+        return text
+    return extraction_pool.parse(path, kind)
+
+def store_sheet_tables(file_id, version, tables):
+    """Keep a workbook's sheets as columnar tables; the text is still usable if this fails"""
+    try:
+        sheet_store.put(file_id, version, tables)
     except Exception as e:
-        print(f"Error extracting text from {file_id}: {e}")
-    
-    return ""
+        print(f"[SHEET STORE] Could not store tables for {file_id}: {e}")
+
+# Optional local mirror of every configured folder, kept current through the Drive Changes API
+drive_mirror = None
+if os.environ.get('DRIVE_MIRROR', '').lower() in ('1', 'true', 'yes'):
+    drive_mirror = DriveMirror(
+        authenticate_gdrive,
+        configured_folder_roots(SEARCH_CONFIG),
+        # Shares in-flight downloads with live searches for the same revision
+        lambda service, meta: drive_downloads.do((meta['id'], file_version(meta)), download_and_cache,
+                                                 meta['id'], meta['mimeType'], service, file_version(meta),
+                                                 meta.get('size')),
+        poll_interval=int(os.environ.get('DRIVE_MIRROR_INTERVAL', 60))
+    )
+
+# Stop words for the BM25 indexes come from the same file as the query patterns
+SEARCH_STOP_WORDS = load_stop_words('query_patterns.json')
 
 def load_query_patterns():
     """Load query patterns for better understanding"""
@@ -288,6 +374,67 @@ def parse_search_query(query):
     
     return search_query
 
+def candidate_search_batches(search_terms, folder_id_groups):
+    """Split every group's folder set into query-size-safe chunks, grouped into small batches"""
+    queries = []
+    for group_index, folder_ids in enumerate(folder_id_groups):
+        for parents_clause in parents_clauses(folder_ids):
+            search_query = f"(name contains '{search_terms}' or fullText contains '{search_terms}') and trashed = false and {parents_clause}"
+            queries.append((group_index, search_query))
+    return [queries[start:start + SEARCH_QUERIES_PER_BATCH] for start in range(0, len(queries), SEARCH_QUERIES_PER_BATCH)]
+
+def run_candidate_searches(queries):
+    """Run one batch of Drive full-text searches (runs on a worker thread); one file list per query"""
+    service = authenticate_gdrive()
+    requests = [
+        service.files().list(
+            q=search_query,
+            fields="files(id, name, mimeType, modifiedTime, md5Checksum, size)",
+            pageSize=5
+        )
+        for _, search_query in queries
+    ]
+    
+    candidates = []
+    for response, exception in execute_batch(service, requests):
+        if exception is not None:
+            print(f"Drive search error: {exception}")
+            candidates.append([])
+        else:
+            candidates.append(response.get('files', []))
+    return candidates
+
+def top_candidates(ranked_files, limit=DRIVE_CANDIDATES_PER_GROUP):
+    """Merge chunk results for one group: best Drive rank first, newer files breaking ties"""
+    files = sorted(ranked_files.values(), key=lambda entry: entry[1].get('modifiedTime', ''), reverse=True)
+    files.sort(key=lambda entry: entry[0])
+    return [file for _, file in files[:limit]]
+
+def extract_candidate(file):
+    """Fetch and extract one search candidate (runs on a worker thread)"""
+    return extract_text_from_drive_file(file['id'], file['mimeType'], authenticate_gdrive(), file_version(file),
+                                        file.get('size'))
+
+def search_drive_mirror(search_terms, folders_to_search):
+    """Answer a Drive search from the local mirror - no Drive API round trips"""
+    results = []
+    seen_ids = set()
+    for folder_group in folders_to_search:
+        for file, content, score, chunks in drive_mirror.search(search_terms, folder_group['root_id'], limit=3):
+            if file['id'] in seen_ids:
+                continue
+            seen_ids.add(file['id'])
+            results.append({
+                'filename': file['name'],
+                'content': content[:2000],
+                'full_content': content,
+                'score': score,
+                'chunks': chunks,
+                'weight': folder_group['weight'],
+                'source': folder_group['source']
+            })
+    return results
+
 def search_google_drive(query, service, user=None):
     """Search for files in Google Drive with user-specific prioritization"""
     if not service:
@@ -299,6 +446,9 @@ def search_google_drive(query, service, user=None):
     search_terms = parse_search_query(query)
     print(f"[DRIVE SEARCH] Original query: '{query}' -> Parsed terms: '{search_terms}'")
     
+    if drive_mirror:
+        drive_mirror.start()
+    
     # Check if user mentioned a specific folder
     folder_keywords = ['product folder', 'products folder', 'project folder', 'team folder']
     mentioned_folder = None
@@ -322,103 +472,186 @@ def search_google_drive(query, service, user=None):
                     user = folder_user  # Use correct case
                     break
         
+        team_folder_id = SEARCH_CONFIG.get('default_team_folder', PARENT_FOLDER_ID)
+        root_ids = [fid for fid in (user_folder_id, team_folder_id) if fid]
+        # A mirror that is in sync answers the search and knows the folder tree - no Drive calls
+        use_mirror = drive_mirror is not None and drive_mirror.ready
+        if use_mirror:
+            group_folder_ids = {root_id: drive_mirror.descendants(root_id) for root_id in root_ids}
+        else:
+            group_folder_ids = search_folder_ids(service, root_ids)
+        
         if user_folder_id:
-            user_subfolders = get_subfolders(service, user_folder_id)
-            user_folder_ids = [user_folder_id] + user_subfolders
             folders_to_search.append({
-                'folder_ids': user_folder_ids,
+                'root_id': user_folder_id,
+                'folder_ids': group_folder_ids[user_folder_id],
                 'weight': SEARCH_CONFIG['search_weights']['user_folder'],
                 'source': f"{user}'s folder"
             })
         
         # Add team folder
-        team_folder_id = SEARCH_CONFIG.get('default_team_folder', PARENT_FOLDER_ID)
-        team_subfolders = get_subfolders(service, team_folder_id)
-        team_folder_ids = [team_folder_id] + team_subfolders
         folders_to_search.append({
-            'folder_ids': team_folder_ids,
+            'root_id': team_folder_id,
+            'folder_ids': group_folder_ids[team_folder_id],
             'weight': SEARCH_CONFIG['search_weights']['team_folder'],
             'source': "WMA Team folder"
         })
         
-        # Search each folder group
-        for folder_group in folders_to_search:
-            folder_ids = folder_group['folder_ids'][:10]  # Limit to 10 folders per group
-            folder_query = " or ".join([f"'{fid}' in parents" for fid in folder_ids])
-            search_query = f"(name contains '{search_terms}' or fullText contains '{search_terms}') and trashed = false and ({folder_query})"
-            
-            response = service.files().list(
-                q=search_query,
-                fields="files(id, name, mimeType, modifiedTime)",
-                pageSize=5
-            ).execute()
-            
-            files = response.get('files', [])
-            
-            for file in files[:3]:  # Process first 3 files per folder group
-                content = extract_text_from_drive_file(file['id'], file['mimeType'], service)
-                if content and search_terms.lower() in content.lower():
-                    results.append({
-                        'filename': file['name'],
-                        'content': content[:2000],  # First 2000 chars for AI context
-                        'full_content': content,  # Keep full content for detailed analysis
-                        'weight': folder_group['weight'],
-                        'source': folder_group['source']
-                    })
+        if use_mirror:
+            return search_drive_mirror(search_terms, folders_to_search)
+        
+        if drive_throttle.breaker.state == 'open':
+            print("[DRIVE SEARCH] Drive is backing off after repeated errors - skipping live search")
+            return []
+        
+        # Search every folder of every group: chunked queries, run as parallel batches
+        deadline = time.monotonic() + DRIVE_SEARCH_DEADLINE
+        list_futures = {
+            drive_executor.submit(drive_throttle.bind(user, run_candidate_searches), batch): batch
+            for batch in candidate_search_batches(search_terms, [folder_group['folder_ids'] for folder_group in folders_to_search])
+        }
+        listed, not_listed = wait(list_futures, timeout=max(0, deadline - time.monotonic()))
+        for future in not_listed:
+            future.cancel()
+        if not_listed:
+            print(f"[DRIVE SEARCH] {len(not_listed)} folder chunk batch(es) missed the {DRIVE_SEARCH_DEADLINE}s deadline")
+        
+        # De-duplicate files reached through several chunks, keeping their best rank
+        ranked = [{} for _ in folders_to_search]  # per group: file id -> (rank, file)
+        for future in listed:
+            try:
+                responses = future.result()
+            except Exception as e:
+                print(f"Drive search error: {e}")
+                continue
+            for (group_index, _), files in zip(list_futures[future], responses):
+                for rank, file in enumerate(files):
+                    best = ranked[group_index].get(file['id'])
+                    if best is None or rank < best[0]:
+                        ranked[group_index][file['id']] = (rank, file)
+        candidate_groups = [top_candidates(group_files) for group_files in ranked]
+        
+        # Fetch and extract the top files of each group concurrently
+        candidates = {}
+        extract_futures = {}  # file id -> future, so a file in both groups is fetched once
+        for group_index, files in enumerate(candidate_groups):
+            for rank, file in enumerate(files):
+                candidates[(group_index, rank)] = file
+                if file['id'] not in extract_futures:
+                    extract_futures[file['id']] = drive_executor.submit(drive_throttle.bind(user, extract_candidate), file)
+        
+        done, not_done = wait(extract_futures.values(), timeout=max(0, deadline - time.monotonic()))
+        for future in not_done:
+            # Drop queued work; downloads already running finish in the background and warm the text cache
+            future.cancel()
+        if not_done:
+            print(f"[DRIVE SEARCH] {len(not_done)} file(s) missed the {DRIVE_SEARCH_DEADLINE}s deadline")
+        
+        # Chunk the extracted candidates and score them with BM25; files sharing none of the terms are dropped
+        extracted = {}  # file id -> (file, folder group, content), first group wins
+        candidate_index = ChunkIndex(SEARCH_STOP_WORDS)
+        for group_index, rank in sorted(candidates):
+            file, folder_group = candidates[(group_index, rank)], folders_to_search[group_index]
+            future = extract_futures[file['id']]
+            if file['id'] in extracted or future not in done:
+                continue
+            try:
+                content = future.result()
+            except Exception as e:
+                print(f"Error extracting text from {file['id']}: {e}")
+                continue
+            if content:
+                extracted[file['id']] = (file, folder_group, content)
+                candidate_index.add(file['id'], content, title=file['name'])
+        
+        for file_id, score, chunks in candidate_index.search(search_terms, k=None):
+            file, folder_group, content = extracted[file_id]
+            results.append({
+                'filename': file['name'],
+                'content': content[:2000],  # First 2000 chars for AI context
+                'full_content': content,  # Keep full content for detailed analysis
+                'score': score,
+                'chunks': chunks,  # Best-matching chunks, best first
+                'weight': folder_group['weight'],
+                'source': folder_group['source']
+            })
                 
     except Exception as e:
         print(f"Drive search error: {e}")
     
-    # Sort results by weight (user folder results first)
-    results.sort(key=lambda x: x.get('weight', 1.0), reverse=True)
+    # Sort results by weight (user folder results first), best BM25 score first within a weight
+    results.sort(key=lambda x: (x.get('weight', 1.0), x.get('score', 0.0)), reverse=True)
     
     return results
 
+def parse_local_doc(path, filename, mtime):
+    """Text of one app/docs file for the local corpus; None for unsupported or quarantined files"""
+    kind = document_kind(file_name=filename)
+    if kind not in ('pdf', 'docx', 'txt', 'xlsx'):
+        return None
+    # Local files that broke the extraction limits stay skipped until they change
+    local_key = f"local:{filename}"
+    local_version = str(mtime)
+    if text_cache.quarantined(local_key, local_version):
+        return None
+    if kind == 'txt':
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    try:
+        return extraction_pool.parse(os.path.abspath(path), kind, filename)
+    except ExtractionRejected as e:
+        text_cache.quarantine(local_key, local_version, e.reason)
+        print(f"[EXTRACTION] Quarantined {filename}: {e.reason}")
+        return None
+
+# app/docs parsed once into memory, chunked and BM25-indexed; a watcher thread re-extracts only files that change
+local_chunks = ChunkIndex(SEARCH_STOP_WORDS)
+# Chunk embeddings for paraphrased questions, re-fitted whenever the local documents change
+local_dense = DenseRetriever(local_chunks, lambda: make_embedder(stop_words=SEARCH_STOP_WORDS))
+local_corpus = LocalCorpus(
+    LOCAL_DOCS_DIR,
+    parse_local_doc,
+    poll_interval=int(os.environ.get('LOCAL_DOCS_POLL_INTERVAL', 10)),
+    exclude=LOCAL_SYSTEM_FILES,
+    index=local_chunks,
+    on_change=local_dense.rebuild if local_dense.available else None
+)
+
 def search_local_docs(query):
     """Search through local documents in app/docs folder"""
-    docs_path = "app/docs"
     results = []
     
     # Parse the query to extract actual search terms
     search_terms = parse_search_query(query)
     print(f"[DRIVE SEARCH] Original query: '{query}' -> Parsed terms: '{search_terms}'")
     
-    # List of system files to exclude from search results
-    system_files = ['WMA_AI_Agent_System_Prompt.txt', 'WMA_AI_Agent_System_Prompt.docx']
-    
-    if os.path.exists(docs_path):
-        for filename in os.listdir(docs_path):
-            # Skip system prompt files
-            if filename in system_files:
+    # Documents are already parsed and indexed - ranking only reads the query terms' postings
+    local_corpus.start()
+    keyword_hits = local_corpus.search(search_terms, LOCAL_RESULTS, wait=LOCAL_LOAD_WAIT)
+    matches = {document.name: [document, chunks] for document, _, chunks in keyword_hits}
+    
+    # Dense retrieval finds sections phrased differently from the terms
+    dense_hits = []
+    if local_dense.ready:
+        for name, _, chunks in local_dense.search(search_terms, LOCAL_RESULTS, min_score=DENSE_MIN_SIMILARITY):
+            document = local_corpus.get(name)
+            if document is None:
                 continue
-            
-            filepath = os.path.join(docs_path, filename)
-            content = ""
-            
-            try:
-                if filename.endswith('.txt'):
-                    with open(filepath, 'r', encoding='utf-8') as f:
-                        content = f.read()
-                        
-                elif filename.endswith('.pdf'):
-                    pdf_document = fitz.open(filepath)
-                    for page in pdf_document:
-                        content += page.get_text()
-                    pdf_document.close()
-                    
-                elif filename.endswith('.docx'):
-                    doc = DocxDoc(filepath)
-                    content = '\n'.join([paragraph.text for paragraph in doc.paragraphs])
-                
-                # Search for query in content
-                if content and search_terms.lower() in content.lower():
-                    results.append({
-                        'filename': filename,
-                        'content': content[:2000],
-                        'full_content': content
-                    })
-            except Exception as e:
-                print(f"Error reading {filename}: {e}")
+            dense_hits.append(name)
+            match = matches.setdefault(name, [document, []])
+            match[1] = match[1] + [chunk for chunk in chunks if chunk not in match[1]]
+    
+    # BM25 scores and cosines are on different scales - merge the two rankings by position
+    fused = fuse_rankings([(1.0, [document.name for document, _, _ in keyword_hits]), (DENSE_WEIGHT, dense_hits)])
+    for name in sorted(fused, key=fused.get, reverse=True):
+        document, chunks = matches[name]
+        results.append({
+            'filename': document.name,
+            'content': document.text[:2000],
+            'full_content': document.text,
+            'score': fused[name],
+            'chunks': chunks
+        })
     
     return results
 
@@ -450,6 +683,26 @@ def load_products_vendors():
     except:
         return None
 
+def page_citation(text, position):
+    """' (page N)' for a character position in PagedText, '' when pages are unknown"""
+    if isinstance(text, PagedText) and text.offsets and position >= 0:
+        return f" ({text.unit} {text.locate(position)})"
+    return ""
+
+def chunk_excerpt(chunks, budget=EXCERPT_CHARS):
+    """Prompt text from a document's best chunks: as many as fit the budget, in reading order, labelled"""
+    selected, used = [], 0
+    for chunk in chunks:
+        if selected and used + len(chunk.text) > budget:
+            continue
+        selected.append(chunk)
+        used += len(chunk.text)
+    parts = []
+    for chunk in sorted(selected, key=lambda chunk: chunk.start):
+        label = chunk.label()
+        parts.append(f"[{label}]\n{chunk.text}" if label else chunk.text)
+    return "\n...\n".join(parts)
+
 def ai_summarize(query, documents, user=None):
     """Use OpenAI GPT to intelligently summarize search results"""
     print(f"\n=== AI Summarize Debug ===")
@@ -464,6 +717,13 @@ def ai_summarize(query, documents, user=None):
         # Fallback to simple extraction if no AI available
         simple_results = []
         for doc in documents:
+            if doc.get('chunks'):
+                # The best chunk is already the relevant passage
+                chunk = doc['chunks'][0]
+                source_info = f" (from {doc.get('source', 'documents')})" if 'source' in doc else ""
+                label = f" ({chunk.label()})" if chunk.label() else ""
+                simple_results.append(f"From {doc['filename']}{source_info}{label}: {chunk.text[:300].strip()}")
+                continue
             content = doc['content']
             index = content.lower().find(query.lower())
             if index != -1:
@@ -471,7 +731,7 @@ def ai_summarize(query, documents, user=None):
                 end = min(len(content), index + 150)
                 snippet = content[start:end].strip()
                 source_info = f" (from {doc.get('source', 'documents')})" if 'source' in doc else ""
-                simple_results.append(f"From {doc['filename']}{source_info}: {snippet}")
+                simple_results.append(f"From {doc['filename']}{source_info}{page_citation(doc.get('full_content'), index)}: {snippet}")
         return "\n\n---\n\n".join(simple_results) if simple_results else f"No information found about '{query}'."
     
     # Prepare context for AI
@@ -484,7 +744,16 @@ def ai_summarize(query, documents, user=None):
         
         # Try to extract only relevant portions instead of full document
         content = doc['content']
-        if len(content) > 3000:  # If document is very long
+        full_content = doc.get('full_content')
+        if doc.get('chunks'):
+            content = chunk_excerpt(doc['chunks'])
+        elif isinstance(full_content, PagedText) and full_content.offsets:
+            # Cut the passage starting at the best-matching page straight out by its offset
+            number, _ = full_content.best_segment(query.lower().split())
+            start = full_content.offsets[number - 1]
+            content = full_content[start:start + 2000]
+            source_info += f", {full_content.unit} {number}"
+        elif len(content) > 3000:  # If document is very long
             # Find most relevant section
             query_words = query.lower().split()
             best_start = 0
@@ -537,6 +806,7 @@ Instructions:
 - Be specific and include relevant key facts from the documents
 - Keep the response concise and to the point
 - Use natural language suitable for text-to-speech
+- When an excerpt is labelled with a page number, mention the page you took a fact from
 - If the information isn't in the documents, say so clearly"""
     
     # Add personalization based on user profile
@@ -604,9 +874,23 @@ def search_all_sources(query, user=None):
     # Search Google Drive if authenticated
     service = authenticate_gdrive()
     if service:
-        drive_results = search_google_drive(query, service, user)
+        with drive_throttle.user_scope(user):
+            drive_results = search_google_drive(query, service, user)
         all_documents.extend(drive_results)
     
+    # Rank across sources: each source's scores come from its own index, so only the order
+    # within a source is comparable - fuse the per-source rankings, weighted by folder weight
+    sources = {}
+    for position, doc in enumerate(all_documents):
+        sources.setdefault(doc.get('source', 'local'), []).append(position)
+    fused = fuse_rankings(
+        (all_documents[positions[0]].get('weight', 1.0),
+         sorted(positions, key=lambda position: all_documents[position].get('score', 0.0), reverse=True))
+        for positions in sources.values()
+    )
+    all_documents = [all_documents[position] for position in sorted(fused, key=fused.get, reverse=True)]
+    all_documents = all_documents[:SEARCH_TOP_K]
+    
     if not all_documents:
         # Check product knowledge base for direct matches
         pv_knowledge = load_products_vendors()
@@ -961,6 +1245,9 @@ def add_user():
         
         # Update global config
         SEARCH_CONFIG = config
+        folder_index.set_roots(configured_folder_roots(config))
+        if drive_mirror:
+            drive_mirror.set_roots(configured_folder_roots(config))
         
         # Redirect with the plain password to display it once
         from urllib.parse import urlencode
@@ -1002,6 +1289,9 @@ def delete_user():
         
         # Update global config
         SEARCH_CONFIG = config
+        folder_index.set_roots(configured_folder_roots(config))
+        if drive_mirror:
+            drive_mirror.set_roots(configured_folder_roots(config))
         
         return redirect(url_for('admin', message=f'User {username} deleted'))
     except Exception as e:
@@ -1138,9 +1428,44 @@ def api_status():
         'ai_enabled': bool(openai_client),
         'ai_model': 'gpt-4o-mini' if openai_client else None,
         'authenticated': current_user.is_authenticated,
-        'user': current_user.username if current_user.is_authenticated else None
+        'user': current_user.username if current_user.is_authenticated else None,
+        'text_cache': text_cache.stats(),
+        'folder_index': folder_index.stats(),
+        'drive_mirror': drive_mirror.stats() if drive_mirror else None,
+        'drive_throttle': drive_throttle.stats(),
+        'drive_downloads': drive_downloads.stats(),
+        'extraction_pool': extraction_pool.stats(),
+        'sheet_store': sheet_store.stats(),
+        'local_corpus': local_corpus.stats(),
+        'local_dense': local_dense.stats()
     })
 
+@app.route('/api/sheets/<file_id>')
+@login_required
+def api_sheet_tables(file_id):
+    """Columns and row counts of a spreadsheet that has been searched before"""
+    tables = sheet_store.get(file_id)
+    if not tables:
+        return jsonify({'error': 'No tables stored for this file'}), 404
+    return jsonify({'file_id': file_id, 'version': sheet_store.version(file_id),
+                    'sheets': [table.describe() for table in tables]})
+
+@app.route('/api/sheets/<file_id>/query', methods=['POST'])
+@login_required
+def api_sheet_query(file_id):
+    """Aggregate over a stored spreadsheet, e.g.
+    {"function": "sum", "column": "Leads", "filters": [["Dealer", "==", "Pierre Ford"], ["Date", "month", "July"]]}
+    """
+    spec = request.get_json(silent=True) or {}
+    if not isinstance(spec, dict):
+        return jsonify({'error': 'Expected a JSON object'}), 400
+    try:
+        result = sheet_store.query(file_id, spec.get('sheet'), spec.get('function', 'count'),
+                                   spec.get('column'), spec.get('filters', []), spec.get('group_by'))
+    except SheetQueryError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'file_id': file_id, 'query': spec, 'result': result})
+
 @app.route('/api/users')
 def api_users():
     """Get list of available users for search filtering"""
@@ -1291,6 +1616,12 @@ if __name__ == '__main__':
         except Exception as e:
             print(f"Could not save default user: {e}")
     
+    # Build the folder index (and Drive mirror, if enabled) in the background before the first query needs it
+    folder_index.start()
+    if drive_mirror:
+        drive_mirror.start()
+    local_corpus.start()
+    
     port = int(os.environ.get('PORT', 5000))
     print(f"Starting Flask with Authentication on port {port}")
     print(f"AI enabled: {bool(openai_client)}")
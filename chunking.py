@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Structure-aware splitting of extracted document text into retrieval chunks
+Documents are cut once, when they are indexed, into overlapping chunks of about
+CHUNK_CHARS characters. Cuts fall on paragraph (line) boundaries, or on sentence
+boundaries inside very long paragraphs, and a heading always starts a new chunk so a
+chunk does not straddle two sections. Each chunk keeps its character offsets into the
+source text, the heading it sits under and, for PagedText, its page/paragraph number,
+and gets an id that stays the same as long as the document and chunk text do.
+"""
+import hashlib
+import re
+
+from document_text import PagedText
+
+CHUNK_CHARS = 1200  # Target chunk length
+CHUNK_OVERLAP = 200  # Text repeated from the end of the previous chunk
+MIN_SECTION_CHARS = 300  # A heading only starts a new chunk once the current one has this much
+MAX_HEADING_CHARS = 80
+_LINE = re.compile(r'[^\n]+')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+_NUMBERED = re.compile(r'^(?:\d+(?:\.\d+)*[.)]?|(?:chapter|section|part|step)\s+\w+)\s', re.IGNORECASE)
+_WORD = re.compile(r"[A-Za-z][\w'-]*")
+_MINOR_WORDS = {'a', 'an', 'and', 'as', 'at', 'by', 'for', 'in', 'of', 'on', 'or', 'the', 'to', 'vs', 'with'}
+
+
+class Chunk:
+    """A contiguous span text[start:end] of one document"""
+
+    __slots__ = ('id', 'key', 'index', 'start', 'end', 'text', 'heading', 'segment', 'unit')
+
+    def __init__(self, key, index, start, end, text, heading=None, segment=0, unit=None):
+        self.id = chunk_id(key, start, text)
+        self.key = key  # The document's key (file name or Drive id)
+        self.index = index  # Position among the document's chunks
+        self.start = start
+        self.end = end
+        self.text = text
+        self.heading = heading  # Nearest heading at or before the chunk, if any
+        self.segment = segment  # 1-based page/paragraph number of the start (0 if unknown)
+        self.unit = unit  # 'page', 'paragraph', ... when segment is known
+
+    def label(self):
+        """'Heading, page 3' style description of where the chunk comes from"""
+        parts = []
+        if self.heading:
+            parts.append(self.heading)
+        if self.segment:
+            parts.append(f"{self.unit} {self.segment}")
+        return ", ".join(parts)
+
+
+def chunk_id(key, start, text):
+    """Deterministic id from the document key, offset and chunk text"""
+    digest = hashlib.sha1(f"{key}\0{start}\0{text}".encode('utf-8', errors='ignore')).hexdigest()
+    return digest[:16]
+
+
+def is_heading(line):
+    """Short line that looks like a title: numbered, markdown, ALL CAPS or Title Case, no closing period"""
+    line = line.strip()
+    if not line or len(line) > MAX_HEADING_CHARS or line[-1] in '.,;!?':
+        return False
+    if line.startswith('#') or _NUMBERED.match(line):
+        return True
+    words = _WORD.findall(line)
+    if not words or len(words) > 12:
+        return False
+    if line.isupper():
+        return True
+    significant = [word for word in words if word.lower() not in _MINOR_WORDS]
+    return bool(significant) and all(word[0].isupper() for word in significant)
+
+
+def _units(text, max_chars):
+    """(start, end, heading?, paragraph start?) spans of the sentences of each line of text
+
+    Headings are single units; sentences longer than max_chars are cut at spaces.
+    """
+    for match in _LINE.finditer(text):
+        start, end = match.span()
+        while start < end and text[start].isspace():
+            start += 1
+        while end > start and text[end - 1].isspace():
+            end -= 1
+        if start == end:
+            continue
+        if is_heading(text[start:end]):
+            yield start, end, True, True
+            continue
+        paragraph_start = True
+        for sentence_start, sentence_end in _sentences(text, start, end):
+            for piece_start, piece_end in _hard_split(text, sentence_start, sentence_end, max_chars):
+                yield piece_start, piece_end, False, paragraph_start
+                paragraph_start = False
+
+
+def _sentences(text, start, end):
+    for boundary in _SENTENCE_END.finditer(text, start, end):
+        yield start, boundary.start()
+        start = boundary.end()
+    if start < end:
+        yield start, end
+
+
+def _hard_split(text, start, end, max_chars):
+    while end - start > max_chars:
+        cut = text.rfind(' ', start + max_chars // 2, start + max_chars)
+        cut = cut if cut != -1 else start + max_chars
+        yield start, cut
+        start = cut
+        while start < end and text[start].isspace():
+            start += 1
+    if start < end:
+        yield start, end
+
+
+def chunk_document(key, text, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """Split a document into overlapping Chunks along its paragraphs, sentences and headings"""
+    units = list(_units(text, chunk_chars))
+    headings = []  # Heading text in force at each unit
+    current = None
+    for start, end, heading, _ in units:
+        if heading:
+            current = text[start:end].strip('# ').strip()
+        headings.append(current)
+
+    paged = isinstance(text, PagedText) and text.offsets
+    chunks = []
+    first = 0
+    while first < len(units):
+        chunk_start = units[first][0]
+        last = first + 1  # Exclusive
+        while last < len(units):
+            start, end, heading, _ = units[last]
+            if heading and units[last - 1][1] - chunk_start >= MIN_SECTION_CHARS:
+                break
+            if end - chunk_start > chunk_chars:
+                # Full: end at the last paragraph break instead, if that keeps at least half a chunk
+                for paragraph in range(last - 1, first, -1):
+                    if units[paragraph][3]:
+                        if units[paragraph - 1][1] - chunk_start >= chunk_chars // 2:
+                            last = paragraph
+                        break
+                break
+            last += 1
+        end = units[last - 1][1]
+        chunks.append(Chunk(key, len(chunks), chunk_start, end, text[chunk_start:end], headings[first],
+                            text.locate(chunk_start) if paged else 0, text.unit if paged else None))
+        if last >= len(units):
+            break
+        if units[last][2]:
+            first = last  # New section - no overlap across headings
+            continue
+        # Step back so the next chunk repeats up to `overlap` characters (whole sentences) of this one
+        next_first = last
+        while next_first - 1 > first and not units[next_first - 1][2] and \
+                end - units[next_first - 1][0] <= overlap:
+            next_first -= 1
+        first = next_first
+    return chunks
@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""
+Dense-vector retrieval over document chunks
+Chunks from a ChunkIndex are turned into unit-length vectors by a pluggable Embedder
+and stored as rows of one contiguous float32 matrix, so a query is a single
+matrix-vector product (cosine similarity) plus a partial sort. The built-in LsaEmbedder
+needs no network or model download: it learns TF-IDF weights and a truncated SVD
+(latent semantic analysis) of the corpus with NumPy, which lets paraphrased questions
+match chunks that share few exact words. SentenceTransformerEmbedder plugs in a
+sentence-transformers model when that package is installed. Past ANN_MIN_CHUNKS chunks
+the matrix is regrouped into an approximate IVF index (ann_index.py) so queries no
+longer scan every row.
+
+numpy is optional: without it DenseRetriever.available is False and callers fall back
+to BM25 alone.
+"""
+import math
+import os
+import threading
+import time
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from search_index import tokenize
+
+LSA_DIMENSIONS = 192
+LSA_MAX_FEATURES = 2048  # Vocabulary kept for TF-IDF; the SVD works on a features x features matrix
+EMBED_BATCH = 256  # Texts embedded per matrix product
+SEARCH_BLOCK = 65536  # Matrix rows scored per block, bounding the size of the score array
+SENTENCE_MODEL = 'all-MiniLM-L6-v2'
+ANN_MIN_CHUNKS = int(os.environ.get('ANN_MIN_CHUNKS', 50_000))  # Switch from exact to IVF search at this size
+ANN_NPROBE = int(os.environ.get('ANN_NPROBE', 8))  # IVF lists scanned per query (recall vs latency)
+
+
+class Embedder:
+    """Turns texts into L2-normalized float32 vectors of a fixed dimension"""
+
+    dimension = None
+
+    def fit(self, texts):
+        """Learn from the corpus before embedding it (a no-op for pre-trained models)"""
+        return self
+
+    def embed(self, texts):
+        """(len(texts), dimension) float32 array, one unit-length row per text"""
+        raise NotImplementedError
+
+
+class LsaEmbedder(Embedder):
+    """Offline embedder: sublinear TF-IDF projected onto the top singular vectors of the corpus"""
+
+    def __init__(self, dimension=LSA_DIMENSIONS, max_features=LSA_MAX_FEATURES, stop_words=frozenset()):
+        self.target_dimension = dimension
+        self.max_features = max_features
+        self.stop_words = frozenset(stop_words)
+        self.dimension = None
+        self.vocabulary = {}  # term -> column
+        self.idf = None
+        self.components = None  # (features, dimension) projection
+
+    def fit(self, texts):
+        token_counts = [Counter(tokenize(text, self.stop_words)) for text in texts]
+        document_frequency = Counter()
+        for counts in token_counts:
+            document_frequency.update(counts.keys())
+        terms = [term for term, _ in document_frequency.most_common(self.max_features)]
+        self.vocabulary = {term: column for column, term in enumerate(terms)}
+        total = len(token_counts)
+        self.idf = np.array([math.log((1 + total) / (1 + document_frequency[term])) + 1 for term in terms],
+                            dtype=np.float32)
+
+        # Right singular vectors of X are the eigenvectors of X^T X - a features x features
+        # matrix that is accumulated batch by batch, so X is never held in full
+        gram = np.zeros((len(terms), len(terms)), dtype=np.float32)
+        for start in range(0, total, EMBED_BATCH):
+            rows = self._tfidf(token_counts[start:start + EMBED_BATCH])
+            gram += rows.T @ rows
+        dimension = min(self.target_dimension, len(terms), total)
+        if dimension == 0:
+            self.components = np.zeros((len(terms), 0), dtype=np.float32)
+        else:
+            _, vectors = np.linalg.eigh(gram)  # Ascending eigenvalues
+            self.components = np.ascontiguousarray(vectors[:, ::-1][:, :dimension], dtype=np.float32)
+        self.dimension = dimension
+        return self
+
+    def _tfidf(self, token_counts):
+        rows = np.zeros((len(token_counts), len(self.vocabulary)), dtype=np.float32)
+        for row, counts in enumerate(token_counts):
+            known = [(self.vocabulary[term], count) for term, count in counts.items() if term in self.vocabulary]
+            if known:
+                columns = [column for column, _ in known]
+                frequencies = np.array([count for _, count in known], dtype=np.float32)
+                rows[row, columns] = (1 + np.log(frequencies)) * self.idf[columns]
+        return _normalize(rows)
+
+    def embed(self, texts):
+        if self.components is None:
+            raise RuntimeError("LsaEmbedder.fit must run before embed")
+        token_counts = [Counter(tokenize(text, self.stop_words)) for text in texts]
+        return _normalize(self._tfidf(token_counts) @ self.components)
+
+
+class SentenceTransformerEmbedder(Embedder):
+    """Pre-trained sentence-transformers model (downloaded on first use, loaded once per process)"""
+
+    _models = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_name=SENTENCE_MODEL):
+        from sentence_transformers import SentenceTransformer
+
+        with self._models_lock:
+            if model_name not in self._models:
+                self._models[model_name] = SentenceTransformer(model_name)
+        self.model = self._models[model_name]
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, texts):
+        vectors = self.model.encode(list(texts), batch_size=EMBED_BATCH, convert_to_numpy=True,
+                                    normalize_embeddings=True)
+        return np.ascontiguousarray(vectors, dtype=np.float32)
+
+
+def make_embedder(name=None, stop_words=frozenset()):
+    """Embedder selected by name ('lsa' or 'sentence-transformers'; default from EMBEDDER, else 'lsa')"""
+    name = (name or os.environ.get('EMBEDDER') or 'lsa').lower()
+    if name == 'lsa':
+        return LsaEmbedder(stop_words=stop_words)
+    if name in ('sentence-transformers', 'sentence_transformers'):
+        return SentenceTransformerEmbedder(os.environ.get('EMBEDDER_MODEL', SENTENCE_MODEL))
+    raise ValueError(f"Unknown embedder '{name}'")
+
+
+def _normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+class DenseIndex:
+    """Row vectors in one contiguous float32 matrix, searched by cosine similarity
+
+    Vectors must be unit length, so the dot product is the cosine. Removing a row moves
+    the last row into its place, keeping the live rows contiguous.
+    """
+
+    def __init__(self, dimension, capacity=1024):
+        self.dimension = dimension
+        self._matrix = np.zeros((capacity, dimension), dtype=np.float32)
+        self._ids = []  # row -> id
+        self._rows = {}  # id -> row
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, item_id):
+        return item_id in self._rows
+
+    @property
+    def matrix(self):
+        """The live rows (a view, not a copy)"""
+        return self._matrix[:len(self._ids)]
+
+    def add(self, ids, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dimension)
+        self.remove([item_id for item_id in ids if item_id in self._rows])
+        needed = len(self._ids) + len(ids)
+        if needed > len(self._matrix):
+            grown = np.zeros((max(needed, 2 * len(self._matrix)), self.dimension), dtype=np.float32)
+            grown[:len(self._ids)] = self.matrix
+            self._matrix = grown
+        start = len(self._ids)
+        self._matrix[start:start + len(ids)] = vectors
+        for offset, item_id in enumerate(ids):
+            self._rows[item_id] = start + offset
+            self._ids.append(item_id)
+
+    def remove(self, ids):
+        for item_id in ids:
+            row = self._rows.pop(item_id, None)
+            if row is None:
+                continue
+            last = len(self._ids) - 1
+            if row != last:
+                moved = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+            self._ids.pop()
+
+    def search(self, queries, k=10):
+        """For each query vector, the k best (id, cosine) pairs, best first"""
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dimension)
+        total = len(self._ids)
+        if not total or not len(queries):
+            return [[] for _ in range(len(queries))]
+        k = min(k, total)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_rows = np.zeros((len(queries), 0), dtype=np.int64)
+        for start in range(0, total, SEARCH_BLOCK):
+            scores = queries @ self._matrix[start:min(total, start + SEARCH_BLOCK)].T
+            rows = np.broadcast_to(np.arange(start, start + scores.shape[1]), scores.shape)
+            scores = np.concatenate([best_scores, scores], axis=1)
+            rows = np.concatenate([best_rows, rows], axis=1)
+            if scores.shape[1] > k:
+                keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                scores = np.take_along_axis(scores, keep, axis=1)
+                rows = np.take_along_axis(rows, keep, axis=1)
+            best_scores, best_rows = scores, rows
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        return [[(self._ids[row], float(score)) for row, score in zip(rows, scores)]
+                for rows, scores in zip(best_rows, best_scores)]
+
+
+class DenseRetriever:
+    """Embeddings of every chunk in a ChunkIndex, rebuilt when the indexed documents change"""
+
+    def __init__(self, chunk_index, embedder_factory, ann_min_chunks=ANN_MIN_CHUNKS, nprobe=ANN_NPROBE):
+        self.chunk_index = chunk_index
+        self._embedder_factory = embedder_factory  # () -> Embedder; a fresh one is fitted per rebuild
+        self.ann_min_chunks = ann_min_chunks
+        self.nprobe = nprobe
+        self.embedder = None
+        self.index = None
+        self.built_at = None
+        self.build_seconds = None
+        self._chunks = {}  # chunk id -> Chunk, as of the last rebuild
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return np is not None
+
+    @property
+    def ready(self):
+        return self.index is not None
+
+    def rebuild(self, *_):
+        """Fit the embedder on the current chunks and embed them all; searches keep the old matrix meanwhile"""
+        if not self.available:
+            return False
+        started = time.time()
+        chunks = self.chunk_index.all_chunks()
+        texts = [f"{chunk.heading or ''}\n{chunk.text}" for chunk in chunks]
+        try:
+            embedder = self._embedder_factory().fit(texts)
+            index = DenseIndex(embedder.dimension, capacity=max(len(chunks), 1))
+            for start in range(0, len(chunks), EMBED_BATCH):
+                batch = chunks[start:start + EMBED_BATCH]
+                index.add([chunk.id for chunk in batch], embedder.embed(texts[start:start + EMBED_BATCH]))
+            if len(chunks) >= self.ann_min_chunks:
+                from ann_index import IvfIndex
+
+                ivf = IvfIndex(embedder.dimension, nprobe=self.nprobe)
+                ivf.train(index.matrix)
+                ivf.add([chunk.id for chunk in chunks], index.matrix)
+                index = ivf
+        except Exception as e:
+            print(f"[DENSE INDEX] Rebuild failed: {e}")
+            return False
+        with self._lock:
+            self.embedder, self.index = embedder, index
+            self._chunks = {chunk.id: chunk for chunk in chunks}
+        self.built_at = time.time()
+        self.build_seconds = self.built_at - started
+        print(f"[DENSE INDEX] Embedded {len(chunks)} chunks in {self.build_seconds:.2f}s")
+        return True
+
+    def search(self, query, k=10, chunks_per_document=3, min_score=0.0):
+        """Top-k (key, cosine, chunks) for a query, like ChunkIndex.search; [] until the first rebuild"""
+        with self._lock:
+            embedder, index, chunks = self.embedder, self.index, self._chunks
+        if index is None or not len(index):
+            return []
+        # Several chunks per document can rank high - ask for enough to fill k documents
+        hits = index.search(embedder.embed([query]), k * chunks_per_document * 2)[0]
+        documents = {}  # key -> [score, chunks]
+        for chunk_id, score in hits:
+            if score <= min_score:
+                break
+            chunk = chunks[chunk_id]
+            entry = documents.setdefault(chunk.key, [score, []])
+            if len(entry[1]) < chunks_per_document:
+                entry[1].append(chunk)
+        ranked = sorted(documents.items(), key=lambda item: item[1][0], reverse=True)[:k]
+        return [(key, score, best) for key, (score, best) in ranked]
+
+    def stats(self):
+        return {
+            'available': self.available,
+            'chunks': len(self.index) if self.index is not None else 0,
+            'dimension': self.embedder.dimension if self.embedder is not None else None,
+            'search': None if self.index is None else 'exact' if isinstance(self.index, DenseIndex) else 'ivf',
+            'build_seconds': round(self.build_seconds, 2) if self.build_seconds is not None else None
+        }
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""
+Text extraction helpers shared by the Flask and Streamlit apps
+PDFs are read one page at a time, so reading stops at the character budget (or the
+page/time limits) instead of parsing every page of a large document. Page texts are
+collected in a list and joined once rather than concatenated onto a growing string.
+
+DOCX files are read straight from the XML inside the zip (body, tables, text boxes,
+headers and footers) without building python-docx's object model.
+
+Extracted text is returned as PagedText: an ordinary string that also carries the
+offset at which every page (PDF) or paragraph (DOCX) starts, so a passage can be cut
+out by page and cited by page number.
+"""
+import io
+import re
+import time
+import zipfile
+from array import array
+from bisect import bisect_right
+from xml.etree import ElementTree
+
+DEFAULT_MAX_CHARS = 2_000_000  # Hard ceiling for one document's text (~600 dense pages)
+
+_W = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+_W_P, _W_TC, _W_T, _W_TAB, _W_BR, _W_CR = (_W + tag for tag in ('p', 'tc', 't', 'tab', 'br', 'cr'))
+DEFAULT_ROW_BUDGET = 5000  # Spreadsheet rows turned into text per workbook
+_DOCX_HEADER_FOOTER = re.compile(r'word/(header|footer)\d*\.xml$')
+
+
+class PagedText(str):
+    """Extracted text plus the start offset of each page or paragraph"""
+
+    def __new__(cls, text, offsets=(), unit='page', truncated=None):
+        paged = super().__new__(cls, text)
+        paged.offsets = offsets if isinstance(offsets, array) else array('I', offsets)
+        paged.unit = unit
+        paged.truncated = truncated  # Why text is missing ('chars', 'rows', 'pages', 'time', 'memory'), if it is
+        return paged
+
+    def locate(self, position):
+        """1-based page/paragraph number containing a character position (0 if unknown)"""
+        return bisect_right(self.offsets, position) if self.offsets else 0
+
+    def segment(self, number):
+        """Text of one page/paragraph, by 1-based number"""
+        if not 1 <= number <= len(self.offsets):
+            return ""
+        end = self.offsets[number] if number < len(self.offsets) else len(self)
+        return self[self.offsets[number - 1]:end]
+
+    def best_segment(self, words):
+        """(number, text) of the page/paragraph with the most occurrences of the words"""
+        if not self.offsets:
+            return 0, ""
+        hits = {}
+        lowered = self.lower()
+        for word in set(w for w in words if w):
+            position = lowered.find(word)
+            while position != -1:
+                number = self.locate(position)
+                hits[number] = hits.get(number, 0) + 1
+                position = lowered.find(word, position + len(word))
+        if not hits:
+            return 1, self.segment(1)
+        number = max(hits, key=lambda n: (hits[n], -n))
+        return number, self.segment(number)
+
+
+def join_segments(segments, separator="", unit='page'):
+    """Join page/paragraph texts once, recording where each one starts"""
+    offsets = array('I')
+    position = 0
+    for index, segment in enumerate(segments):
+        if index:
+            position += len(separator)
+        offsets.append(position)
+        position += len(segment)
+    return PagedText(separator.join(segments), offsets, unit)
+
+
+def iter_docx_segments(part):
+    """Stream paragraphs and table cells out of one WordprocessingML part (a file object)
+
+    Paragraphs are emitted as they close, each table cell as its paragraphs joined by
+    spaces. Text boxes nested inside a paragraph come out as paragraphs of their own.
+    """
+    containers = [[]]  # Innermost open table cell collects its paragraphs; bottom entry is the output
+    runs = []  # Text collected for each open paragraph (text boxes nest paragraphs)
+    for event, element in ElementTree.iterparse(part, events=('start', 'end')):
+        tag = element.tag
+        if event == 'start':
+            if tag == _W_P:
+                runs.append([])
+            elif tag == _W_TC:
+                containers.append([])
+            continue
+        if tag == _W_T and runs:
+            runs[-1].append(element.text or "")
+        elif tag in (_W_TAB, _W_BR, _W_CR) and runs:
+            runs[-1].append("\t" if tag == _W_TAB else "\n")
+        elif tag == _W_P and runs:
+            text = "".join(runs.pop()).strip()
+            if text:
+                containers[-1].append(text)
+            element.clear()
+        elif tag == _W_TC and len(containers) > 1:
+            cell = " ".join(containers.pop())
+            if cell:
+                containers[-1].append(cell)
+            element.clear()
+        if len(containers) == 1 and containers[0]:
+            yield from containers[0]
+            containers[0].clear()
+
+
+def extract_docx_text(source):
+    """Text of a .docx read straight from its XML: body paragraphs and table cells, then
+    headers/footers (each distinct text once). Returns PagedText with paragraph offsets."""
+    segments = []
+    with zipfile.ZipFile(_file_like(source)) as archive:
+        names = archive.namelist()
+        with archive.open('word/document.xml') as part:
+            segments.extend(iter_docx_segments(part))
+        seen = set(segments)
+        parts = [n for n in names if _DOCX_HEADER_FOOTER.match(n)]
+        for name in sorted(parts, key=lambda n: ('footer' in n, n)):  # Headers before footers
+            with archive.open(name) as part:
+                for segment in iter_docx_segments(part):
+                    if segment not in seen:  # Headers/footers repeat per section
+                        seen.add(segment)
+                        segments.append(segment)
+    return join_segments(segments, "\n", unit='paragraph')
+
+
+def iter_pdf_pages(source):
+    """Yield the text of each page in order; source is a file path or the PDF bytes"""
+    import fitz  # PyMuPDF - imported here so the text cache can use PagedText without it
+    if isinstance(source, str):
+        pdf_document = fitz.open(source)
+    else:
+        pdf_document = fitz.open(stream=source, filetype="pdf")
+    try:
+        for page in pdf_document:
+            yield page.get_text()
+    finally:
+        pdf_document.close()
+
+
+def extract_pdf_text(source, max_chars=DEFAULT_MAX_CHARS, separator="", max_pages=None, time_budget=None):
+    """Extract PDF text page by page, stopping early when possible
+
+    Reading stops once max_chars have been collected; max_pages, time_budget (seconds)
+    and running out of memory also stop it. Whenever text is left out, the reason is in
+    .truncated ('chars', 'pages', 'time' or 'memory'). Returns PagedText with page offsets.
+    """
+    pages = []
+    length = 0
+    deadline = time.monotonic() + time_budget if time_budget else None
+    truncated = None
+
+    try:
+        for page_text in iter_pdf_pages(source):
+            if max_chars and length >= max_chars:
+                truncated = 'chars'  # Another page exists beyond the character budget
+                break
+            if pages:
+                length += len(separator)
+            pages.append(page_text)
+            length += len(page_text)
+            if max_pages and len(pages) >= max_pages:
+                truncated = 'pages'
+                break
+            if deadline and time.monotonic() > deadline:
+                truncated = 'time'
+                break
+    except MemoryError:
+        if not pages:
+            raise
+        truncated = 'memory'  # Keep the pages read before the memory ceiling was hit
+
+    text = join_segments(pages, separator)
+    if max_chars and len(text) > max_chars:
+        text = PagedText(text[:max_chars], [offset for offset in text.offsets if offset < max_chars])
+        truncated = truncated or 'chars'
+    text.truncated = truncated
+    return text
+
+
+def document_kind(mime_type=None, file_name=None):
+    """'pdf', 'docx', 'txt', 'xlsx' or 'xls' for a Drive mime type or a file name; None if unsupported"""
+    kinds = {
+        'application/pdf': 'pdf',
+        'application/vnd.openxmlformats-officedocument.wordprocessingml.document': 'docx',
+        'text/plain': 'txt',
+        'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet': 'xlsx',
+        'application/vnd.ms-excel': 'xls'
+    }
+    if mime_type in kinds:
+        return kinds[mime_type]
+    name = (file_name or '').lower()
+    for suffix, kind in (('.pdf', 'pdf'), ('.docx', 'docx'), ('.txt', 'txt'), ('.xlsx', 'xlsx'), ('.xls', 'xls')):
+        if name.endswith(suffix):
+            return kind
+    return None
+
+
+def extract_xlsx_text(source, file_name='', row_budget=DEFAULT_ROW_BUDGET):
+    """Summary plus searchable row text of an .xlsx, read in one streaming pass
+
+    openpyxl's read-only mode yields rows straight from the sheet XML, so only the
+    current row is in memory. Every sheet contributes a summary (rows, columns, a few
+    sample rows) and one "Sheet 'name' row N: column: value, ..." line per row, until
+    row_budget rows have been read across the workbook. Returns PagedText, one line per
+    segment, with .truncated = 'rows' when the budget cut the workbook short.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(_file_like(source), read_only=True, data_only=True)
+    try:
+        summary = [f"Excel File: {file_name}", f"Number of sheets: {len(workbook.sheetnames)}", "Sheet contents:"]
+        row_lines = []
+        budget = row_budget
+        truncated = False
+        for sheet in workbook.worksheets:
+            header = None
+            data_rows = 0
+            samples = []
+            complete = True
+            for values in sheet.iter_rows(values_only=True):
+                cells = ["" if value is None else str(value).strip() for value in values]
+                if not any(cells):
+                    continue
+                if header is None:
+                    header = [cell or f"Column {index + 1}" for index, cell in enumerate(cells)]
+                    continue
+                if budget <= 0:
+                    complete = False
+                    truncated = True
+                    break
+                budget -= 1
+                data_rows += 1
+                pairs = [f"{header[index] if index < len(header) else f'Column {index + 1}'}: {cell}"
+                         for index, cell in enumerate(cells) if cell]
+                row_lines.append(f"Sheet '{sheet.title}' row {data_rows}: {', '.join(pairs)}")
+                if len(samples) < 3:
+                    samples.append(", ".join(f"{name}: {_clip(cells[index])}"
+                                             for index, name in enumerate(header[:3]) if index < len(cells)))
+
+            summary.append(f"\nSheet '{sheet.title}':")
+            rows_text = f"{data_rows} rows" if complete else f"{data_rows}+ rows (row budget reached)"
+            summary.append(f"  - {rows_text}, {len(header or [])} columns")
+            if header:
+                summary.append(f"  - Columns: {', '.join(header[:5])}")
+                if len(header) > 5:
+                    summary.append(f"    ... and {len(header) - 5} more columns")
+            if samples:
+                summary.append("  - Sample data:")
+                summary.extend(f"    Row {number}: {sample}" for number, sample in enumerate(samples, 1))
+    finally:
+        workbook.close()
+
+    lines = "\n".join(summary).split("\n") + ([""] if row_lines else []) + row_lines
+    text = join_segments(lines, "\n", unit='line')
+    if truncated:
+        text.truncated = 'rows'
+    return text
+
+
+def _clip(value, length=30):
+    """Shorten a cell value for the sample rows"""
+    return value if len(value) <= length else value[:length] + "..."
+
+
+def excel_summary(source, file_name=''):
+    """Readable summary of a legacy .xls workbook: sheets, shapes, columns and a few sample rows"""
+    import pandas as pd
+    
+    try:
+        # Read Excel file
+        excel_file = pd.ExcelFile(_file_like(source))
+        summary_parts = []
+        
+        summary_parts.append(f"Excel File: {file_name}")
+        summary_parts.append(f"Number of sheets: {len(excel_file.sheet_names)}")
+        summary_parts.append("Sheet contents:")
+        
+        # Process each sheet (limit to first 3 sheets for mobile)
+        for i, sheet_name in enumerate(excel_file.sheet_names[:3]):
+            df = pd.read_excel(excel_file, sheet_name=sheet_name)
+            
+            summary_parts.append(f"\nSheet '{sheet_name}':")
+            summary_parts.append(f"  - {df.shape[0]} rows, {df.shape[1]} columns")
+            
+            # Add column names
+            if len(df.columns) > 0:
+                columns = list(df.columns)[:5]  # First 5 columns
+                summary_parts.append(f"  - Columns: {', '.join(str(col) for col in columns)}")
+                if len(df.columns) > 5:
+                    summary_parts.append(f"    ... and {len(df.columns) - 5} more columns")
+            
+            # Add sample data from first few rows
+            if not df.empty:
+                summary_parts.append("  - Sample data:")
+                for idx, row in df.head(3).iterrows():
+                    row_summary = []
+                    for col in df.columns[:3]:  # First 3 columns only
+                        value = str(row[col])[:30]  # Truncate long values
+                        if len(str(row[col])) > 30:
+                            value += "..."
+                        row_summary.append(f"{col}: {value}")
+                    summary_parts.append(f"    Row {idx + 1}: {', '.join(row_summary)}")
+        
+        if len(excel_file.sheet_names) > 3:
+            summary_parts.append(f"\n... and {len(excel_file.sheet_names) - 3} more sheets")
+        
+        return "\n".join(summary_parts)
+        
+    except Exception as excel_error:
+        return f"Excel file detected but could not be processed: {str(excel_error)}"
+
+
+def parse_document(source, kind, file_name='', **options):
+    """Extract text from a downloaded document - the unit of work for extraction workers
+
+    source is a file path (preferred: parsers read it from disk as needed) or the raw
+    bytes. options go to the kind's extractor (e.g. separator/max_pages for PDFs).
+    """
+    if kind == 'pdf':
+        return extract_pdf_text(source, **options)
+    if kind == 'docx':
+        return extract_docx_text(source)
+    if kind == 'txt':
+        if isinstance(source, str):
+            with open(source, 'rb') as f:
+                source = f.read()
+        return source.decode('utf-8', errors='ignore')
+    if kind == 'xlsx':
+        return extract_xlsx_text(source, file_name, **options)
+    if kind == 'xls':
+        return excel_summary(source, file_name)
+    raise ValueError(f"Unsupported document type: {kind}")
+
+
+def _file_like(source):
+    """Paths are opened by the parser itself; bytes are wrapped without copying"""
+    return source if isinstance(source, str) else io.BytesIO(source)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Batching layer for Google Drive metadata calls
+Many independent files().list calls are grouped into Drive HTTP batch
+requests (at most 100 calls per batch), and results are split back out per call in
+the original order. Paged listings are continued in follow-up batches until every
+call has returned all of its pages, so a folder crawl costs one round trip per level
+instead of one per folder.
+"""
+import time
+
+from drive_throttle import backoff_delay, is_retryable_error
+
+MAX_BATCH_SIZE = 100  # Drive rejects batches with more than 100 calls
+PARENTS_PER_QUERY = 40  # 'in parents' terms per query, well under Drive's query length limit
+BATCH_RETRIES = 3  # Re-sends of individual calls that came back rate limited
+
+
+def parents_clauses(folder_ids, chunk_size=PARENTS_PER_QUERY):
+    """Split a folder set into "('a' in parents or 'b' in parents ...)" clauses of bounded size"""
+    folder_ids = list(folder_ids)
+    return [
+        "(" + " or ".join(f"'{fid}' in parents" for fid in folder_ids[start:start + chunk_size]) + ")"
+        for start in range(0, len(folder_ids), chunk_size)
+    ]
+
+
+def execute_batch(service, requests):
+    """Execute HttpRequests through the batch endpoint; returns [(response, exception), ...] in order
+
+    Calls rejected with a rate-limit error are sent again in a later batch after a
+    backoff, since Drive throttles the parts of a batch individually.
+    """
+    results = [(None, None)] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    pending = list(range(len(requests)))
+    for attempt in range(BATCH_RETRIES + 1):
+        for start in range(0, len(pending), MAX_BATCH_SIZE):
+            batch = service.new_batch_http_request(callback=callback)
+            for index in pending[start:start + MAX_BATCH_SIZE]:
+                batch.add(requests[index], request_id=str(index))
+            batch.execute()
+        pending = [index for index in pending if is_retryable_error(results[index][1])]
+        if not pending or attempt == BATCH_RETRIES:
+            break
+        time.sleep(backoff_delay(attempt))
+    return results
+
+
+def batch_list(service, queries, fields="nextPageToken, files(id, name)", page_size=1000, **list_kwargs):
+    """Run many files().list queries in batches, following nextPageToken for each
+
+    Returns one list of files per query. A query whose call fails is reported and
+    keeps whatever pages it had already returned.
+    """
+    files = [[] for _ in queries]
+    page_tokens = {index: None for index in range(len(queries))}
+
+    while page_tokens:
+        pending = list(page_tokens.items())
+        requests = [
+            service.files().list(q=queries[index], fields=fields, pageSize=page_size,
+                                 pageToken=token, **list_kwargs)
+            for index, token in pending
+        ]
+        page_tokens = {}
+        for (index, _), (response, exception) in zip(pending, execute_batch(service, requests)):
+            if exception is not None:
+                print(f"[DRIVE BATCH] List failed for query {queries[index][:80]!r}: {exception}")
+                continue
+            files[index].extend(response.get('files', []))
+            if response.get('nextPageToken'):
+                page_tokens[index] = response['nextPageToken']
+    return files
+
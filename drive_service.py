@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Process-wide Google Drive service pool shared by the Flask and Streamlit apps
+Credentials are built once and refreshed by a background thread shortly before they
+expire. Each thread gets its own Drive service (httplib2 is not thread-safe) built
+from a discovery document that is parsed only once per process.
+"""
+import json
+import threading
+from datetime import datetime
+import httplib2
+import google_auth_httplib2
+from google.auth.transport.requests import Request
+from googleapiclient.discovery import build, build_from_document
+
+try:
+    from googleapiclient.discovery_cache import get_static_doc
+except ImportError:  # Older google-api-python-client without bundled discovery docs
+    get_static_doc = None
+
+REFRESH_MARGIN = 300  # Refresh the access token 5 minutes before it expires
+HTTP_TIMEOUT = 60
+
+
+class DriveServicePool:
+    """Thread-safe source of Drive services backed by one shared set of credentials"""
+
+    def __init__(self, credentials_factory, refresh_margin=REFRESH_MARGIN, timeout=HTTP_TIMEOUT, throttle=None):
+        self._credentials_factory = credentials_factory
+        self.throttle = throttle  # Optional DriveThrottle applied to every HTTP call
+        self.refresh_margin = refresh_margin
+        self.timeout = timeout
+        self._creds = None
+        self._discovery_doc = None
+        self._generation = 0  # Bumped whenever credentials are replaced
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._refresher = None
+
+    def _credentials(self):
+        """Build credentials on first use and start the background refresher"""
+        if self._creds is not None:
+            return self._creds
+        with self._lock:
+            if self._creds is None:
+                creds = self._credentials_factory()
+                if not creds:
+                    return None
+                if not creds.valid and creds.refresh_token:
+                    creds.refresh(Request())
+                self._creds = creds
+                self._generation += 1
+                self._start_refresher()
+            return self._creds
+
+    def _discovery(self, creds):
+        """Return the parsed Drive v3 discovery document, loading it once per process"""
+        if self._discovery_doc is None:
+            doc = get_static_doc('drive', 'v3') if get_static_doc else None
+            if doc is None:
+                # No bundled copy - fetch it once and reuse the service's description
+                doc = build('drive', 'v3', credentials=creds)._rootDesc
+            self._discovery_doc = json.loads(doc) if isinstance(doc, str) else doc
+        return self._discovery_doc
+
+    def get(self):
+        """Return the calling thread's Drive service, or None when Drive is not configured"""
+        creds = self._credentials()
+        if creds is None:
+            return None
+        local = self._local
+        if getattr(local, 'service', None) is None or local.generation != self._generation:
+            http = google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http(timeout=self.timeout))
+            if self.throttle is not None:
+                http = self.throttle.wrap(http)
+            local.service = build_from_document(self._discovery(creds), http=http)
+            local.generation = self._generation
+        return local.service
+
+    def _start_refresher(self):
+        if self._refresher is None or not self._refresher.is_alive():
+            self._refresher = threading.Thread(target=self._refresh_loop, name='drive-token-refresh', daemon=True)
+            self._refresher.start()
+
+    def _seconds_until_refresh(self):
+        expiry = self._creds.expiry if self._creds else None
+        if expiry is None:
+            return self.refresh_margin
+        # google-auth reports expiry as a naive UTC datetime
+        remaining = (expiry - datetime.utcnow()).total_seconds()
+        return max(0, remaining - self.refresh_margin)
+
+    def _refresh_loop(self):
+        """Refresh the shared token ahead of expiry so no request ever waits on it"""
+        while not self._stopped.wait(self._seconds_until_refresh()):
+            creds = self._creds
+            if creds is None:
+                continue  # reset() - the next get() rebuilds credentials
+            if not creds.refresh_token:
+                return
+            try:
+                with self._lock:
+                    # Services hold a reference to this object, so refreshing in place reaches them all
+                    creds.refresh(Request())
+                print(f"[DRIVE POOL] Token refreshed, valid until {creds.expiry}")
+            except Exception as e:
+                print(f"[DRIVE POOL] Token refresh failed: {e}")
+                self._stopped.wait(60)  # Back off before retrying
+
+    def reset(self):
+        """Drop cached credentials and services, e.g. after the stored token changes"""
+        with self._lock:
+            self._creds = None
+            self._generation += 1
+
+    def close(self):
+        """Stop the background refresher"""
+        self._stopped.set()
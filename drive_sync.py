@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+"""
+Incremental local mirror of the configured Google Drive folders
+A full crawl seeds the mirror once; after that only changes.list is polled, so the
+mirror re-extracts just the files whose content actually changed (new md5Checksum or
+modifiedTime). Metadata is persisted to a JSON state file and extracted text goes to
+the shared text cache and straight into a chunked BM25 index, so queries can run
+entirely against local data. The index keeps every mirrored file's chunks, so text the
+size-bounded cache has evicted is still searchable. Only the sync thread changes the
+index: every sync also picks up files whose current revision is not indexed yet (after a
+restart, evicted before indexing, failed extraction), and the mirror reports ready only
+once its index covers the mirrored files. Searches just read the index.
+"""
+import json
+import os
+import threading
+import time
+
+from drive_batch import batch_list, parents_clauses
+from folder_index import FOLDER_MIME, crawl_folder_tree
+from search_index import ChunkIndex, load_stop_words
+from text_cache import text_cache, file_version
+
+DEFAULT_STATE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.text_cache', 'drive_mirror.json')
+DEFAULT_POLL_INTERVAL = 60  # seconds between changes.list polls
+FILE_FIELDS = "id, name, mimeType, parents, trashed, modifiedTime, md5Checksum, size"
+
+
+class DriveMirror:
+    """Local copy of file metadata and extracted text for a set of Drive root folders"""
+
+    def __init__(self, service_factory, roots, extract, state_path=DEFAULT_STATE_PATH,
+                 text_store=text_cache, poll_interval=DEFAULT_POLL_INTERVAL, index=None):
+        self._service_factory = service_factory
+        self.roots = dict(roots)  # root folder id -> label
+        self._extract = extract  # extract(service, file_meta) -> text
+        self.state_path = state_path
+        self.text_store = text_store
+        self.poll_interval = poll_interval
+        self.index = index if index is not None else ChunkIndex(load_stop_words())
+        self._index_lock = threading.Lock()
+        self.page_token = None
+        self._indexed = False  # The index holds every mirrored file's current revision
+        self.folders = {}  # folder id -> {'name', 'parents'} for every folder seen
+        self.files = {}  # file id -> metadata for files inside tracked folders
+        self.last_sync = None
+        self._tracked = set()
+        self._lock = threading.RLock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def ready(self):
+        """In sync with Drive and fully indexed - until then searches should go to Drive"""
+        return self.page_token is not None and self._indexed
+
+    # ---- persistence -------------------------------------------------
+
+    def load_state(self):
+        """Restore a previous mirror's metadata (ignored if it was built for different roots)
+
+        The index is not persisted, so the mirror is not ready until the next sync has
+        rebuilt it from the text store.
+        """
+        if not self.state_path or not os.path.exists(self.state_path):
+            return False
+        try:
+            with open(self.state_path, 'r') as f:
+                state = json.load(f)
+        except Exception as e:
+            print(f"[DRIVE MIRROR] Could not load state: {e}")
+            return False
+        if state.get('roots') != self.roots:
+            return False
+        with self._lock:
+            self.page_token = state.get('page_token')
+            self.folders = state.get('folders', {})
+            self.files = state.get('files', {})
+            self._tracked = self._tracked_folders()
+        return self.page_token is not None
+
+    def save_state(self):
+        if not self.state_path:
+            return
+        with self._lock:
+            state = {
+                'roots': self.roots,
+                'page_token': self.page_token,
+                'folders': self.folders,
+                'files': self.files
+            }
+        try:
+            os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+            tmp_path = self.state_path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(state, f)
+            os.replace(tmp_path, self.state_path)
+        except Exception as e:
+            print(f"[DRIVE MIRROR] Could not save state: {e}")
+
+    # ---- syncing -----------------------------------------------------
+
+    def bootstrap(self, service):
+        """Full crawl of every root; the change token is taken first so nothing is missed"""
+        token = service.changes().getStartPageToken().execute()['startPageToken']
+        tree = crawl_folder_tree(service, self.roots)
+        with self._lock:
+            self.folders = {
+                folder_id: {'name': node['name'], 'parents': [node['parent']] if node['parent'] else []}
+                for folder_id, node in tree.nodes.items()
+            }
+            self.files = {}
+            self._tracked = set(tree.nodes)
+        changed = self._list_files(service, list(tree.nodes))
+        self._prune_index()
+        self._extract_files(service, changed)
+        with self._lock:
+            self.page_token = token
+            self._indexed = True
+        self.save_state()
+        print(f"[DRIVE MIRROR] Bootstrapped {len(self.files)} files in {len(self.folders)} folders")
+
+    def sync(self):
+        """Apply pending Drive changes; returns the number of files re-extracted"""
+        service = self._service_factory()
+        if not service:
+            return 0
+        if self.page_token is None:
+            self.bootstrap(service)
+            self.last_sync = time.time()
+            return len(self.files)
+
+        changed = set()
+        page_token = self.page_token
+        while page_token:
+            response = service.changes().list(
+                pageToken=page_token,
+                pageSize=1000,
+                includeRemoved=True,
+                spaces='drive',
+                fields=f"nextPageToken, newStartPageToken, changes(fileId, removed, file({FILE_FIELDS}))"
+            ).execute()
+            with self._lock:
+                for change in response.get('changes', []):
+                    if self._apply_change(change):
+                        changed.add(change['fileId'])
+            if response.get('newStartPageToken'):
+                next_token = response['newStartPageToken']
+                page_token = None
+            else:
+                next_token = page_token = response.get('nextPageToken')
+
+        changed |= self._reconcile_folders(service)
+        self._prune_index()
+        with self._lock:
+            # Changed files plus any whose current revision never made it into the index
+            pending = [file_id for file_id, meta in self.files.items()
+                       if file_id in changed or self.index.version(file_id) != file_version(meta)]
+        self._extract_files(service, pending)
+        with self._lock:
+            self.page_token = next_token
+            self._indexed = True
+        self.save_state()
+        self.last_sync = time.time()
+        if changed:
+            print(f"[DRIVE MIRROR] Applied {len(changed)} changed file(s)")
+        return len(changed)
+
+    def _apply_change(self, change):
+        """Update metadata for one change; True when the file's content needs (re)extraction"""
+        file_id = change['fileId']
+        meta = change.get('file')
+        if change.get('removed') or not meta or meta.get('trashed'):
+            self.folders.pop(file_id, None)
+            if self.files.pop(file_id, None) is not None:
+                self.text_store.invalidate(file_id)
+            return False
+
+        if meta.get('mimeType') == FOLDER_MIME:
+            # Membership of folders is settled in _reconcile_folders once the whole page is applied
+            self.folders[file_id] = {'name': meta.get('name', ''), 'parents': meta.get('parents', [])}
+            return False
+
+        previous = self.files.get(file_id)
+        if not any(parent in self._tracked or parent in self.folders for parent in meta.get('parents', [])):
+            if previous is not None:  # Moved out of every tracked folder
+                self.files.pop(file_id)
+                self.text_store.invalidate(file_id)
+            return False
+
+        self.files[file_id] = _file_record(meta)
+        return previous is None or file_version(previous) != file_version(meta)
+
+    def _tracked_folders(self):
+        """Every known folder reachable from a root"""
+        children = {}
+        for folder_id, folder in self.folders.items():
+            for parent in folder.get('parents', []):
+                children.setdefault(parent, []).append(folder_id)
+        tracked = set()
+        queue = list(self.roots)
+        while queue:
+            folder_id = queue.pop()
+            if folder_id in tracked:
+                continue
+            tracked.add(folder_id)
+            queue.extend(children.get(folder_id, []))
+        return tracked
+
+    def _reconcile_folders(self, service):
+        """Crawl folders that moved into the tree and drop files whose folders left it"""
+        with self._lock:
+            previous = self._tracked
+            tracked = self._tracked_folders()
+            self._tracked = tracked
+            # Files recorded against a folder we only learned about later in the same page
+            for file_id, meta in list(self.files.items()):
+                if not any(parent in tracked for parent in meta.get('parents', [])):
+                    self.files.pop(file_id)
+                    self.text_store.invalidate(file_id)
+        added = tracked - previous
+        if not added:
+            return set()
+        # Existing contents of a moved-in folder produce no change records of their own
+        moved_in = [folder_id for folder_id in added
+                    if not any(parent in added for parent in self.folders.get(folder_id, {}).get('parents', []))]
+        for folder_id in moved_in:
+            subtree = crawl_folder_tree(service, {folder_id: self.folders.get(folder_id, {}).get('name', '')})
+            with self._lock:
+                for sub_id, node in subtree.nodes.items():
+                    if sub_id != folder_id:
+                        self.folders[sub_id] = {'name': node['name'], 'parents': [node['parent']]}
+                self._tracked |= set(subtree.nodes)
+                added |= set(subtree.nodes)
+        return self._list_files(service, list(added))
+
+    def _list_files(self, service, folder_ids):
+        """List the non-folder contents of the given folders into the mirror; returns changed ids"""
+        changed = set()
+        queries = [f"{clause} and mimeType != '{FOLDER_MIME}' and trashed = false"
+                   for clause in parents_clauses(folder_ids)]
+        for files in batch_list(service, queries, fields=f"nextPageToken, files({FILE_FIELDS})"):
+            with self._lock:
+                for meta in files:
+                    previous = self.files.get(meta['id'])
+                    self.files[meta['id']] = _file_record(meta)
+                    if previous is None or file_version(previous) != file_version(meta):
+                        changed.add(meta['id'])
+        return changed
+
+    def _prune_index(self):
+        """Drop files that were trashed or left the tracked folders from the index"""
+        with self._lock:
+            files = set(self.files)
+        with self._index_lock:
+            for file_id in self.index.keys():
+                if file_id not in files:
+                    self.index.remove(file_id)
+
+    def _extract_files(self, service, file_ids):
+        """Index files, extracting text only for revisions that are not already in the text store"""
+        for file_id in file_ids:
+            meta = self.files.get(file_id)
+            if meta is None:
+                continue
+            version = file_version(meta)
+            text = self.text_store.get(file_id, version)
+            if text is None:
+                try:
+                    text = self._extract(service, meta) or ""
+                except Exception as e:
+                    print(f"[DRIVE MIRROR] Error extracting {meta.get('name', file_id)}: {e}")
+                    continue
+                self.text_store.put(file_id, version, text)
+            with self._index_lock:
+                self.index.add(file_id, text, version, title=meta.get('name', ''))
+
+    # ---- background polling ------------------------------------------
+
+    def start(self):
+        """Load saved state and keep the mirror in sync from a background thread"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.load_state()
+        self._thread = threading.Thread(target=self._run, name='drive-mirror', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def set_roots(self, roots):
+        """Track a different set of root folders; the next sync re-crawls from scratch"""
+        with self._lock:
+            if dict(roots) != self.roots:
+                self.roots = dict(roots)
+                self.page_token = None
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"[DRIVE MIRROR] Sync failed: {e}")
+            self._stopped.wait(self.poll_interval)
+
+    # ---- queries -----------------------------------------------------
+
+    def descendants(self, folder_id):
+        """Folder id plus every tracked folder beneath it"""
+        with self._lock:
+            children = {}
+            for child_id, folder in self.folders.items():
+                for parent in folder.get('parents', []):
+                    children.setdefault(parent, []).append(child_id)
+        found, queue = [], [folder_id]
+        while queue:
+            current = queue.pop(0)
+            if current in found:
+                continue
+            found.append(current)
+            queue.extend(children.get(current, []))
+        return found
+
+    def search(self, search_terms, folder_id, limit=None):
+        """(file, text, score, best chunks) for the files under a folder that best match the terms (BM25)"""
+        folder_ids = set(self.descendants(folder_id))
+        with self._lock:
+            in_folder = {file_id for file_id, meta in self.files.items()
+                         if any(parent in folder_ids for parent in meta.get('parents', []))}
+
+        matches = []
+        for file_id, score, chunks in self.index.search(search_terms, limit, accept=in_folder.__contains__):
+            meta = self.files.get(file_id)
+            if meta is None:
+                continue
+            text = self.text_store.get(file_id, file_version(meta))
+            if text is None:  # Evicted from the text cache - the index still has every chunk
+                text = self.index.text(file_id)
+            if text:
+                matches.append((meta, text, score, chunks))
+        return matches
+
+    def stats(self):
+        return {
+            'ready': self.ready,
+            'files': len(self.files),
+            'folders': len(self._tracked),
+            'indexed': len(self.index),
+            'last_sync_age_seconds': round(time.time() - self.last_sync) if self.last_sync else None
+        }
+
+
+def _file_record(meta):
+    """The subset of Drive metadata the mirror keeps per file"""
+    return {
+        'id': meta['id'],
+        'name': meta.get('name', ''),
+        'mimeType': meta.get('mimeType', ''),
+        'parents': meta.get('parents', []),
+        'modifiedTime': meta.get('modifiedTime'),
+        'md5Checksum': meta.get('md5Checksum'),
+        'size': meta.get('size')
+    }
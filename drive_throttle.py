@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Client-side throttling for Google Drive API calls shared by the Flask and Streamlit apps
+Every HTTP request a pooled Drive service makes first takes tokens from a global and a
+per-user token bucket (sized below Drive's per-project and per-user quotas). Rate-limit
+and server errors are retried with exponential backoff and jitter. Repeated failures trip
+a circuit breaker that fails calls fast until Drive has had time to recover.
+"""
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+# Drive allows roughly 12,000 queries per minute per project and per user; stay well under
+DEFAULT_GLOBAL_QPS = 100
+DEFAULT_USER_QPS = 20
+DEFAULT_MAX_WAIT = 30  # seconds a call may wait for tokens before giving up
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 32.0
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'backendError')
+RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+
+
+class DriveThrottled(Exception):
+    """Raised when a Drive call is refused locally (circuit open or no tokens in time)"""
+
+
+class TokenBucket:
+    """Classic token bucket: refills at `rate` tokens/second up to `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate * 2)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until `tokens` are available; False if that would take longer than timeout"""
+        tokens = min(tokens, self.capacity)  # A batch larger than the bucket waits for a full bucket
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    @property
+    def available(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            return self._tokens
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` consecutive failures; one trial call is let through after `reset_timeout`"""
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def allow(self):
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self._trial_running:
+                self._trial_running = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_running = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_running = False
+            if self.failures >= self.failure_threshold or self.opened_at is not None:
+                self.opened_at = time.monotonic()
+
+
+def backoff_delay(attempt, base=BACKOFF_BASE, cap=BACKOFF_CAP):
+    """Exponential backoff with full jitter"""
+    return random.uniform(0, min(cap, base * (2 ** attempt)))
+
+
+def is_rate_limited(status, content=b''):
+    """True for responses Drive expects clients to retry after backing off"""
+    if status in RETRYABLE_STATUSES:
+        return True
+    if status == 403:
+        if isinstance(content, bytes):
+            content = content.decode('utf-8', errors='ignore')
+        try:
+            errors = json.loads(content).get('error', {}).get('errors', [])
+        except (ValueError, AttributeError):
+            return False
+        return any(error.get('reason') in RATE_LIMIT_REASONS for error in errors)
+    return False
+
+
+def is_retryable_error(exception):
+    """Whether an HttpError (e.g. one part of a batch) is worth retrying after a backoff"""
+    resp = getattr(exception, 'resp', None)
+    if resp is None:
+        return False
+    return is_rate_limited(getattr(resp, 'status', None), getattr(exception, 'content', b''))
+
+
+class DriveThrottle:
+    """Global + per-user token buckets and a circuit breaker in front of the Drive API"""
+
+    def __init__(self, global_qps=DEFAULT_GLOBAL_QPS, user_qps=DEFAULT_USER_QPS,
+                 max_wait=DEFAULT_MAX_WAIT, max_retries=MAX_RETRIES, breaker=None):
+        self.global_bucket = TokenBucket(global_qps)
+        self.user_qps = user_qps
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.breaker = breaker or CircuitBreaker()
+        self.throttled = 0  # calls that had to back off
+        self.rejected = 0  # calls refused locally
+        self._user_buckets = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    # ---- identity ----------------------------------------------------
+
+    def set_user(self, user):
+        """Charge every later Drive call made by this thread to `user`"""
+        self._local.user = user
+
+    @contextmanager
+    def user_scope(self, user):
+        """Charge Drive calls made by this thread inside the block to `user`"""
+        previous = getattr(self._local, 'user', None)
+        self._local.user = user
+        try:
+            yield
+        finally:
+            self._local.user = previous
+
+    def bind(self, user, fn):
+        """Wrap fn so it runs in user_scope(user) - for work handed to other threads"""
+        def run(*args, **kwargs):
+            with self.user_scope(user):
+                return fn(*args, **kwargs)
+        return run
+
+    def _user_bucket(self):
+        user = getattr(self._local, 'user', None)
+        if not user:
+            return None
+        with self._lock:
+            bucket = self._user_buckets.get(user)
+            if bucket is None:
+                bucket = self._user_buckets[user] = TokenBucket(self.user_qps)
+            return bucket
+
+    # ---- admission ---------------------------------------------------
+
+    def acquire(self, cost=1):
+        """Admit one HTTP call costing `cost` quota units, or raise DriveThrottled"""
+        if self.breaker.state == 'open':
+            self.rejected += 1
+            raise DriveThrottled(f"Drive circuit open after {self.breaker.failures} failures")
+        user_bucket = self._user_bucket()
+        if (user_bucket and not user_bucket.acquire(cost, self.max_wait)) or \
+                not self.global_bucket.acquire(cost, self.max_wait):
+            self.rejected += 1
+            raise DriveThrottled(f"No Drive quota available within {self.max_wait}s")
+        if not self.breaker.allow():  # Half-open and another call is already the trial
+            self.rejected += 1
+            raise DriveThrottled("Drive circuit is half-open, waiting on a trial call")
+
+    def wrap(self, http):
+        return ThrottledHttp(http, self)
+
+    def stats(self):
+        return {
+            'circuit': self.breaker.state,
+            'consecutive_failures': self.breaker.failures,
+            'throttled': self.throttled,
+            'rejected': self.rejected,
+            'global_tokens': round(self.global_bucket.available, 1),
+            'users': len(self._user_buckets)
+        }
+
+
+class ThrottledHttp:
+    """httplib2.Http-compatible wrapper that applies a DriveThrottle to every request"""
+
+    def __init__(self, http, throttle):
+        self._http = http
+        self._throttle = throttle
+
+    def __getattr__(self, name):
+        # credentials, timeout etc. are read straight off the wrapped object by googleapiclient
+        return getattr(self._http, name)
+
+    def request(self, uri, method='GET', body=None, headers=None, *args, **kwargs):
+        throttle = self._throttle
+        # A batch is one HTTP request but each part counts against the quota
+        cost = 1
+        if body and '/batch/' in uri:
+            marker = 'Content-ID:' if isinstance(body, str) else b'Content-ID:'
+            cost = max(1, body.count(marker))
+
+        for attempt in range(throttle.max_retries + 1):
+            throttle.acquire(cost)
+            try:
+                resp, content = self._http.request(uri, method, body, headers, *args, **kwargs)
+            except (ConnectionError, TimeoutError, OSError):
+                throttle.breaker.record_failure()
+                if attempt == throttle.max_retries:
+                    raise
+            except BaseException:
+                # Auth refresh, httplib2 errors etc. - still settle the breaker, or a
+                # half-open trial would never finish and every later call be refused
+                throttle.breaker.record_failure()
+                raise
+            else:
+                if not is_rate_limited(resp.status, content):
+                    throttle.breaker.record_success()
+                    return resp, content
+                throttle.breaker.record_failure()
+                if attempt == throttle.max_retries:
+                    return resp, content  # Let googleapiclient raise the HttpError as usual
+            throttle.throttled += 1
+            delay = backoff_delay(attempt)
+            print(f"[DRIVE THROTTLE] Backing off {delay:.1f}s before retry {attempt + 1} of {method} {uri[:80]}")
+            time.sleep(delay)
+
+
+drive_throttle = DriveThrottle(
+    float(os.environ.get('DRIVE_GLOBAL_QPS', DEFAULT_GLOBAL_QPS)),
+    float(os.environ.get('DRIVE_USER_QPS', DEFAULT_USER_QPS))
+)
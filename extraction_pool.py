@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+Process pool for CPU-bound document parsing shared by the Flask and Streamlit apps
+PyMuPDF, python-docx and pandas hold the GIL while they parse, so running them on
+request threads makes concurrent queries queue behind each other. Documents are sent
+to worker processes as file paths (or bytes) and come back as text, so downloads never
+cross the process boundary; each worker is replaced after a fixed number of documents
+so memory leaked by the parsers cannot accumulate.
+
+Every document is also held to limits: a maximum file size, a page cap and soft time
+budget (PDFs stop early and return the text read so far), an address-space ceiling per
+worker, and a hard wall-clock timeout after which the worker is killed. Documents that
+cannot be parsed within the limits raise ExtractionRejected so callers can quarantine them.
+"""
+import faulthandler
+import multiprocessing
+import multiprocessing.context
+import multiprocessing.spawn
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+
+from document_text import parse_document
+
+try:
+    import resource
+except ImportError:  # Not available on Windows - no memory ceiling there
+    resource = None
+
+DEFAULT_WORKERS = 2
+DEFAULT_DOCS_PER_WORKER = 50
+MAX_DOCUMENT_BYTES = 100 * 1024 * 1024  # Larger files are not downloaded or parsed at all
+MAX_PDF_PAGES = 500
+SOFT_TIMEOUT = 30  # seconds - PDFs return what they have after this
+HARD_TIMEOUT = 60  # seconds - the worker is killed after this
+WORKER_MEMORY_MB = 1024  # Address-space ceiling per worker process
+BACKSTOP_GRACE = 30  # seconds past the hard timeout before the parent gives up on a started parse
+POLL_SECONDS = 0.5  # How often the parent checks whether a worker has picked a document up
+# .truncated reasons that mean a limit cut the parse short; 'chars' and 'rows' are
+# content budgets that long documents and workbooks reach in normal use
+LIMIT_TRUNCATIONS = ('pages', 'time', 'memory')
+
+
+def limit_hit(text):
+    """The extraction limit that left text partial ('pages', 'time', 'memory'), or None"""
+    reason = getattr(text, 'truncated', None)
+    return reason if reason in LIMIT_TRUNCATIONS else None
+
+
+class ExtractionRejected(Exception):
+    """A document was refused or abandoned because it broke an extraction limit"""
+
+    def __init__(self, reason):
+        super().__init__(reason)
+        self.reason = reason
+
+
+_launching = threading.local()  # Set while this pool starts a worker process
+
+
+def _preparation_data(name, _prepare=multiprocessing.spawn.get_preparation_data):
+    """What a spawned child sets up before its task; for pool workers, everything but the parent's __main__"""
+    data = _prepare(name)
+    if getattr(_launching, 'worker', False):
+        # Workers only run functions of this module. Re-running __main__ (python app_flask.py:
+        # config, clients, indexes) would add about a second and ~80MB to every worker start
+        data.pop('init_main_from_path', None)
+        data.pop('init_main_from_name', None)
+    return data
+
+
+multiprocessing.spawn.get_preparation_data = _preparation_data
+
+
+class _WorkerProcess(multiprocessing.context.SpawnProcess):
+    """A spawned process that imports only the parsing code, not the app that started it"""
+
+    @staticmethod
+    def _Popen(process_obj):
+        _launching.worker = True
+        try:
+            return multiprocessing.context.SpawnProcess._Popen(process_obj)
+        finally:
+            _launching.worker = False
+
+
+class _WorkerContext(multiprocessing.context.SpawnContext):
+    Process = _WorkerProcess
+
+
+def _init_worker(memory_bytes):
+    """Runs once in each worker process: cap its address space so a runaway parse raises MemoryError"""
+    if resource is not None and memory_bytes:
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+        except (ValueError, OSError) as e:
+            print(f"[EXTRACTION POOL] Could not set memory ceiling: {e}")
+
+
+def _parse(source, kind, file_name, options, with_tables=False):
+    """Text of a document; with_tables also returns its sheets as columnar tables (None if that fails)"""
+    text = parse_document(source, kind, file_name, **options)
+    if not with_tables:
+        return text
+    from sheet_store import read_sheet_tables
+
+    try:
+        tables = read_sheet_tables(source)
+    except Exception as e:  # The text is still usable without tables
+        print(f"[SHEET STORE] Could not build tables for {file_name or 'workbook'}: {e}")
+        tables = None
+    return text, tables
+
+
+def _guarded_parse(source, kind, file_name, hard_timeout, options, with_tables=False, marker=None):
+    """Parse in a worker; a watchdog thread ends the process if the parser hangs, even inside C code
+
+    The marker file is created when the parse starts, so the parent can tell queued documents
+    from running ones. Before exiting the watchdog writes "Timeout" and the stack to it, so
+    the parent can tell that this document - not another one in the pool - killed the worker.
+    """
+    report = None
+    if hard_timeout:
+        report = open(marker, 'w') if marker else sys.stderr
+        faulthandler.dump_traceback_later(hard_timeout, exit=True, file=report)
+    try:
+        return _parse(source, kind, file_name, options, with_tables)
+    finally:
+        if hard_timeout:
+            faulthandler.cancel_dump_traceback_later()
+        if marker and report is not None:
+            report.close()
+
+
+def _timed_out(marker):
+    """True if a worker's watchdog reported a hard timeout in this marker file"""
+    try:
+        with open(marker, 'r', errors='ignore') as f:
+            return f.read(7) == 'Timeout'
+    except OSError:
+        return False
+
+
+class ExtractionPool:
+    """Parse documents in recycled, resource-limited worker processes (or inline when max_workers is 0)"""
+
+    def __init__(self, max_workers=DEFAULT_WORKERS, docs_per_worker=DEFAULT_DOCS_PER_WORKER,
+                 max_bytes=MAX_DOCUMENT_BYTES, max_pages=MAX_PDF_PAGES, soft_timeout=SOFT_TIMEOUT,
+                 hard_timeout=HARD_TIMEOUT, memory_mb=WORKER_MEMORY_MB):
+        self.max_workers = max_workers
+        self.docs_per_worker = docs_per_worker
+        self.max_bytes = max_bytes
+        self.max_pages = max_pages
+        self.soft_timeout = soft_timeout
+        self.hard_timeout = hard_timeout
+        self.memory_mb = memory_mb
+        self.parsed = 0
+        self.failed = 0
+        self.truncated = 0
+        self.rejected = 0
+        self.restarts = 0
+        self._executor = None
+        self._submitted = 0  # Documents sent to the current executor
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is not None and sys.version_info < (3, 11) and \
+                    self._submitted >= self.docs_per_worker * self.max_workers:
+                # No max_tasks_per_child before 3.11 - recycle the whole pool instead
+                self._executor.shutdown(wait=False)
+                self._executor = None
+            if self._executor is None:
+                # spawn, not fork: both apps run threads, and forking a threaded process is unsafe
+                options = {
+                    'mp_context': _WorkerContext(),
+                    'initializer': _init_worker,
+                    'initargs': (self.memory_mb * 1024 * 1024,)
+                }
+                if sys.version_info >= (3, 11):
+                    options['max_tasks_per_child'] = self.docs_per_worker
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, **options)
+                self._submitted = 0
+            self._submitted += 1
+            return self._executor
+
+    def _discard(self, executor, kill=False):
+        """Replace a pool whose worker died or hung so later documents still work"""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+                self.restarts += 1
+        if kill:
+            # A hung parse never returns on its own and ProcessPoolExecutor has no per-task cancel
+            for process in list((getattr(executor, '_processes', None) or {}).values()):
+                process.kill()
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def check_size(self, size):
+        """Raise ExtractionRejected for a file over the byte limit - call it before downloading"""
+        if size and self.max_bytes and int(size) > self.max_bytes:
+            self.rejected += 1
+            raise ExtractionRejected(f"too large ({int(size) // (1024 * 1024)}MB)")
+
+    def parse(self, source, kind, file_name='', **options):
+        """Text of a document (file path or bytes); blocks the calling thread, not the interpreter
+
+        PDF text cut short by the page/time/memory limits comes back with .truncated set.
+        """
+        return self._run(source, kind, file_name, options)
+
+    def parse_workbook(self, source, file_name='', **options):
+        """(text, SheetTables or None) of an .xlsx, both read in the same worker under the same limits"""
+        return self._run(source, 'xlsx', file_name, options, with_tables=True)
+
+    def _run(self, source, kind, file_name, options, with_tables=False):
+        self.check_size(os.path.getsize(source) if isinstance(source, str) else len(source))
+        if kind == 'pdf':
+            options.setdefault('max_pages', self.max_pages)
+            options.setdefault('time_budget', self.soft_timeout)
+
+        if not self.max_workers:
+            result = _parse(source, kind, file_name, options, with_tables)
+        else:
+            result = self._parse_in_worker(source, kind, file_name, options, with_tables)
+        text = result[0] if with_tables else result
+        self.parsed += 1
+        if getattr(text, 'truncated', None):
+            self.truncated += 1
+        return result
+
+    def _parse_in_worker(self, source, kind, file_name, options, with_tables=False, retry=True):
+        executor = self._get_executor()
+        marker = os.path.join(tempfile.gettempdir(), f"extraction-{uuid.uuid4().hex}.running")
+        future = executor.submit(_guarded_parse, source, kind, file_name, self.hard_timeout, options, with_tables,
+                                 marker)
+        try:
+            return self._wait(future, executor, marker)
+        except BrokenProcessPool:
+            self._discard(executor)
+            if _timed_out(marker):
+                # This document hung and its watchdog ended the worker - retrying would hang again
+                self.failed += 1
+                raise ExtractionRejected(f"timed out after {self.hard_timeout}s (worker killed)")
+            if retry:
+                # Another document may have been the one that took the pool down - try once more
+                return self._parse_in_worker(source, kind, file_name, options, with_tables, retry=False)
+            self.failed += 1
+            raise ExtractionRejected("worker died (memory ceiling, hard timeout or parser crash)")
+        except MemoryError:
+            self.failed += 1
+            raise ExtractionRejected(f"over the {self.memory_mb}MB memory ceiling")
+        except Exception:
+            self.failed += 1
+            raise
+        finally:
+            if os.path.exists(marker):
+                os.remove(marker)
+
+    def _wait(self, future, executor, marker):
+        """Result of a submitted parse; time spent queued behind other documents does not count
+
+        The worker's own watchdog enforces the hard timeout. This is only a backstop for a
+        worker that stops responding altogether, so it raises TimeoutError - not
+        ExtractionRejected - and the document is not quarantined.
+        """
+        if not self.hard_timeout:
+            return future.result()
+        started = None
+        while True:
+            try:
+                return future.result(timeout=POLL_SECONDS)
+            except FutureTimeout:
+                if started is None and os.path.exists(marker):
+                    started = time.monotonic()  # A worker picked the document up
+                if started is not None and time.monotonic() - started > self.hard_timeout + BACKSTOP_GRACE:
+                    self._discard(executor, kill=True)
+                    raise TimeoutError(f"extraction worker unresponsive after {self.hard_timeout + BACKSTOP_GRACE:.0f}s")
+
+    def stats(self):
+        return {
+            'workers': self.max_workers,
+            'docs_per_worker': self.docs_per_worker,
+            'parsed': self.parsed,
+            'truncated': self.truncated,
+            'rejected': self.rejected,
+            'failed': self.failed,
+            'restarts': self.restarts
+        }
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Process-wide pool used by both apps and by indexing jobs
+extraction_pool = ExtractionPool(
+    int(os.environ.get('EXTRACT_WORKERS', DEFAULT_WORKERS)),
+    int(os.environ.get('EXTRACT_DOCS_PER_WORKER', DEFAULT_DOCS_PER_WORKER)),
+    max_bytes=int(os.environ.get('EXTRACT_MAX_MB', MAX_DOCUMENT_BYTES // (1024 * 1024))) * 1024 * 1024,
+    max_pages=int(os.environ.get('EXTRACT_MAX_PAGES', MAX_PDF_PAGES)),
+    soft_timeout=float(os.environ.get('EXTRACT_SOFT_TIMEOUT', SOFT_TIMEOUT)),
+    hard_timeout=float(os.environ.get('EXTRACT_HARD_TIMEOUT', HARD_TIMEOUT)),
+    memory_mb=int(os.environ.get('EXTRACT_MEMORY_MB', WORKER_MEMORY_MB))
+)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""
+In-memory stand-in for the Google Drive v3 service, for exercising the Drive mirror
+and folder crawlers without network access or credentials
+Mutations (add/update/move/trash/delete) append to a change feed served by
+changes.list, and a recorded feed can be replayed with replay(). Only the query
+syntax this project actually sends to files.list is understood.
+"""
+import hashlib
+import json
+import re
+from datetime import datetime, timedelta
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+
+
+class FakeRequest:
+    """Mimics googleapiclient's HttpRequest: call execute() to get the response"""
+
+    def __init__(self, result):
+        self._result = result
+
+    def execute(self, **kwargs):
+        if isinstance(self._result, Exception):
+            raise self._result
+        return self._result
+
+
+class FakeBatch:
+    """Mimics BatchHttpRequest: queued requests run on execute(), errors go to the callback"""
+
+    def __init__(self, drive, callback=None):
+        self._drive = drive
+        self._callback = callback
+        self._requests = []
+
+    def add(self, request, callback=None, request_id=None):
+        if len(self._requests) >= 100:
+            raise ValueError("Drive batches are limited to 100 calls")
+        self._requests.append((request, callback or self._callback, request_id or str(len(self._requests))))
+
+    def execute(self):
+        self._drive.calls['batch'] += 1
+        for request, callback, request_id in self._requests:
+            try:
+                callback(request_id, request.execute(), None)
+            except Exception as e:
+                callback(request_id, None, e)
+
+
+class _FakeFiles:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def list(self, q='', fields=None, pageSize=100, pageToken=None, **kwargs):
+        self._drive.calls['files.list'] += 1
+        matches = [meta for meta in self._drive.items.values() if _matches(meta, q, self._drive.contents)]
+        start = int(pageToken or 0)
+        response = {'files': [dict(meta) for meta in matches[start:start + pageSize]]}
+        if start + pageSize < len(matches):
+            response['nextPageToken'] = str(start + pageSize)
+        return FakeRequest(response)
+
+    def get(self, fileId, fields=None, **kwargs):
+        self._drive.calls['files.get'] += 1
+        meta = self._drive.items.get(fileId)
+        return FakeRequest(dict(meta) if meta else KeyError(fileId))
+
+    def get_media(self, fileId, **kwargs):
+        self._drive.calls['files.get_media'] += 1
+        return FakeRequest(self._drive.contents.get(fileId, KeyError(fileId)))
+
+    def export(self, fileId, mimeType, **kwargs):
+        self._drive.calls['files.export'] += 1
+        return FakeRequest(self._drive.contents.get(fileId, KeyError(fileId)))
+
+
+class _FakeChanges:
+    def __init__(self, drive):
+        self._drive = drive
+
+    def getStartPageToken(self, **kwargs):
+        self._drive.calls['changes.getStartPageToken'] += 1
+        return FakeRequest({'startPageToken': str(len(self._drive.feed))})
+
+    def list(self, pageToken, pageSize=100, includeRemoved=True, **kwargs):
+        self._drive.calls['changes.list'] += 1
+        start = int(pageToken)
+        page = self._drive.feed[start:start + pageSize]
+        if not includeRemoved:
+            page = [change for change in page if not change.get('removed')]
+        response = {'changes': [json.loads(json.dumps(change)) for change in page]}
+        if start + pageSize < len(self._drive.feed):
+            response['nextPageToken'] = str(start + pageSize)
+        else:
+            response['newStartPageToken'] = str(len(self._drive.feed))
+        return FakeRequest(response)
+
+
+class FakeDriveService:
+    """Drop-in for build('drive', 'v3') backed by dictionaries"""
+
+    def __init__(self):
+        self.items = {}  # id -> metadata
+        self.contents = {}  # id -> bytes
+        self.feed = []  # change records, token == index into this list
+        self.calls = {name: 0 for name in (
+            'files.list', 'files.get', 'files.get_media', 'files.export',
+            'changes.getStartPageToken', 'changes.list', 'batch')}
+        self._clock = datetime(2025, 1, 1)
+
+    def files(self):
+        return _FakeFiles(self)
+
+    def changes(self):
+        return _FakeChanges(self)
+
+    def new_batch_http_request(self, callback=None):
+        return FakeBatch(self, callback)
+
+    # ---- mutations ---------------------------------------------------
+
+    def _tick(self):
+        self._clock += timedelta(seconds=1)
+        return self._clock.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+    def _record(self, file_id, removed=False):
+        change = {'fileId': file_id, 'removed': removed}
+        if not removed:
+            change['file'] = dict(self.items[file_id])
+        self.feed.append(change)
+
+    def add_folder(self, folder_id, name, parent=None):
+        self.items[folder_id] = {
+            'id': folder_id, 'name': name, 'mimeType': FOLDER_MIME,
+            'parents': [parent] if parent else [], 'trashed': False, 'modifiedTime': self._tick()
+        }
+        self._record(folder_id)
+
+    def add_file(self, file_id, name, parent, content, mime_type='text/plain'):
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        self.contents[file_id] = data
+        self.items[file_id] = {
+            'id': file_id, 'name': name, 'mimeType': mime_type, 'parents': [parent], 'trashed': False,
+            'modifiedTime': self._tick(), 'md5Checksum': hashlib.md5(data).hexdigest(), 'size': str(len(data))
+        }
+        self._record(file_id)
+
+    def update_file(self, file_id, content):
+        data = content.encode('utf-8') if isinstance(content, str) else content
+        self.contents[file_id] = data
+        self.items[file_id].update(modifiedTime=self._tick(), md5Checksum=hashlib.md5(data).hexdigest(),
+                                   size=str(len(data)))
+        self._record(file_id)
+
+    def rename(self, file_id, name):
+        self.items[file_id].update(name=name, modifiedTime=self._tick())
+        self._record(file_id)
+
+    def move(self, file_id, new_parent):
+        self.items[file_id]['parents'] = [new_parent]
+        self._record(file_id)
+
+    def trash(self, file_id):
+        self.items[file_id]['trashed'] = True
+        self._record(file_id)
+
+    def delete(self, file_id):
+        self.items.pop(file_id, None)
+        self.contents.pop(file_id, None)
+        self._record(file_id, removed=True)
+
+    def replay(self, events):
+        """Apply a recorded feed: [{'op': 'add_file', 'file_id': ..., ...}, ...] or a JSON file path"""
+        if isinstance(events, str):
+            with open(events, 'r') as f:
+                events = json.load(f)
+        for event in events:
+            event = dict(event)
+            getattr(self, event.pop('op'))(**event)
+
+    # ---- helpers -----------------------------------------------------
+
+    def extract(self, service, meta):
+        """Extractor for DriveMirror: the fake's files are stored as UTF-8 text"""
+        return self.contents[meta['id']].decode('utf-8', errors='ignore')
+
+
+def _matches(meta, query, contents):
+    """Evaluate the subset of Drive query syntax used by this project"""
+    if not query:
+        return not meta.get('trashed')
+    if 'trashed = false' in query.replace('trashed=false', 'trashed = false') and meta.get('trashed'):
+        return False
+    parents = re.findall(r"'([^']+)' in parents", query)
+    if parents and not set(parents) & set(meta.get('parents', [])):
+        return False
+    if f"mimeType = '{FOLDER_MIME}'" in query and meta['mimeType'] != FOLDER_MIME:
+        return False
+    if f"mimeType != '{FOLDER_MIME}'" in query and meta['mimeType'] == FOLDER_MIME:
+        return False
+    terms = re.search(r"name contains '((?:[^'\\]|\\.)*)'", query)
+    if terms:
+        needle = terms.group(1).replace("\\'", "'").lower()
+        text = contents.get(meta['id'], b'').decode('utf-8', errors='ignore').lower()
+        full_text = 'fullText contains' in query
+        if needle not in meta['name'].lower() and not (full_text and needle in text):
+            return False
+    return True
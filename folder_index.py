@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+"""
+In-memory Google Drive folder hierarchy for the configured user and team folders
+The tree (id -> parent, children, path) is crawled once and refreshed by a background
+thread, so a search can get the full descendant closure of a folder without listing
+anything on Drive. Readers always see a complete snapshot; refreshes swap it atomically.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from drive_batch import batch_list, parents_clauses
+
+FOLDER_MIME = 'application/vnd.google-apps.folder'
+DEFAULT_REFRESH_INTERVAL = 900  # 15 minutes
+STREAM_WORKERS = 4  # Concurrent multi-parent queries per level in stream_folders
+SNAPSHOT_MAX_AGE = 1200  # 20 minutes before a FolderSnapshot refreshes in the background
+
+
+def configured_folder_roots(config):
+    """Map each configured root folder id to a display label from search_config.json"""
+    roots = {}
+    for user, folder_id in config.get('user_folders', {}).items():
+        roots.setdefault(folder_id, user)
+    team_folder_id = config.get('default_team_folder')
+    if team_folder_id:
+        roots.setdefault(team_folder_id, 'WMA Team')
+    return roots
+
+
+def child_folder_query(parent_id):
+    """Drive query for the direct subfolders of a folder"""
+    return f"'{parent_id}' in parents and mimeType = '{FOLDER_MIME}' and trashed = false"
+
+
+def _list_child_folders(service_factory, parents_clause):
+    """All subfolders of a chunk of parents, every page (runs on a worker thread)"""
+    query = f"{parents_clause} and mimeType = '{FOLDER_MIME}' and trashed = false"
+    return batch_list(service_factory(), [query], fields="nextPageToken, files(id, name, parents)")[0]
+
+
+def stream_folders(service_factory, root_id, root_path="", max_workers=STREAM_WORKERS):
+    """Breadth-first crawl under one folder, yielding {'id', 'name', 'full_path', 'parent'} as found
+
+    Each level is split into multi-parent queries that run concurrently, so folders
+    arrive while deeper levels are still being listed. service_factory is called on
+    the worker threads and must return a service usable from that thread.
+    """
+    seen = {root_id}
+    level = {root_id: root_path}  # folder id -> full path
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='folder-crawl') as executor:
+        while level:
+            futures = [executor.submit(_list_child_folders, service_factory, clause)
+                       for clause in parents_clauses(level)]
+            next_level = {}
+            for future in as_completed(futures):
+                for item in future.result():
+                    if item['id'] in seen:
+                        continue
+                    # Multi-parent queries don't say which parent matched - pick it from the folder itself
+                    parent_id = next((parent for parent in item.get('parents', []) if parent in level), None)
+                    if parent_id is None:
+                        continue
+                    full_path = f"{level[parent_id]}/{item['name']}".strip("/")
+                    seen.add(item['id'])
+                    next_level[item['id']] = full_path
+                    yield {'id': item['id'], 'name': item['name'], 'full_path': full_path, 'parent': parent_id}
+            level = next_level
+
+
+class FolderTree:
+    """Immutable snapshot of the folder hierarchy under a set of roots"""
+
+    def __init__(self, nodes, built_at):
+        self.nodes = nodes  # id -> {'name', 'parent', 'children', 'path'}
+        self.built_at = built_at
+        self._closures = {}
+        for folder_id in nodes:
+            self._build_closure(folder_id)
+
+    def _build_closure(self, folder_id):
+        """Post-order walk so every child's closure exists before its parent's"""
+        stack = [(folder_id, False)]
+        visiting = set()
+        while stack:
+            current, expanded = stack.pop()
+            if current in self._closures:
+                continue
+            children = self.nodes[current]['children']
+            if expanded:
+                closure = [current]
+                for child_id in children:
+                    closure.extend(self._closures.get(child_id, ()))
+                self._closures[current] = tuple(closure)
+            elif current not in visiting:  # Guard against multi-parent cycles
+                visiting.add(current)
+                stack.append((current, True))
+                stack.extend((child_id, False) for child_id in children if child_id not in self._closures)
+
+    def descendants(self, folder_id):
+        """Return the folder id followed by every folder beneath it"""
+        return self._closures.get(folder_id, (folder_id,))
+
+    def __contains__(self, folder_id):
+        return folder_id in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def crawl_folder_tree(service, roots):
+    """Breadth-first crawl of every folder beneath the given {root_id: label} roots"""
+    nodes = {}
+    queue = []
+    for root_id, label in roots.items():
+        if root_id not in nodes:
+            nodes[root_id] = {'name': label, 'parent': None, 'children': [], 'path': label}
+            queue.append(root_id)
+
+    # One batched round trip per tree level instead of one list call per folder
+    while queue:
+        level, queue = queue, []
+        for parent_id, children in zip(level, batch_list(service, [child_folder_query(fid) for fid in level])):
+            parent = nodes[parent_id]
+            for folder in children:
+                existing = nodes.get(folder['id'])
+                if existing is not None:
+                    # A configured root nested inside another root - link it, it is already queued
+                    if existing['parent'] is None and folder['id'] != parent_id:
+                        existing['parent'] = parent_id
+                        parent['children'].append(folder['id'])
+                    continue
+                nodes[folder['id']] = {
+                    'name': folder['name'],
+                    'parent': parent_id,
+                    'children': [],
+                    'path': f"{parent['path']}/{folder['name']}"
+                }
+                parent['children'].append(folder['id'])
+                queue.append(folder['id'])
+
+    return FolderTree(nodes, time.time())
+
+
+class FolderIndex:
+    """Background-refreshed FolderTree for a set of root folders"""
+
+    def __init__(self, service_factory, roots, refresh_interval=DEFAULT_REFRESH_INTERVAL):
+        self._service_factory = service_factory
+        self.roots = dict(roots)
+        self.refresh_interval = refresh_interval
+        self.tree = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    @property
+    def ready(self):
+        return self.tree is not None
+
+    def start(self):
+        """Start the background crawler (safe to call repeatedly)"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='folder-index', daemon=True)
+                self._thread.start()
+
+    def set_roots(self, roots):
+        """Replace the configured roots and rebuild the tree soon"""
+        self.roots = dict(roots)
+        self._wakeup.set()
+
+    def refresh(self):
+        """Crawl Drive now and swap in the new tree; keeps the old tree on failure"""
+        service = self._service_factory()
+        if not service:
+            return False
+        started = time.time()
+        try:
+            tree = crawl_folder_tree(service, self.roots)
+        except Exception as e:
+            print(f"[FOLDER INDEX] Refresh failed: {e}")
+            return False
+        self.tree = tree
+        print(f"[FOLDER INDEX] Indexed {len(tree)} folders in {time.time() - started:.1f}s")
+        return True
+
+    def _run(self):
+        while True:
+            # Retry sooner while we have never managed to build a tree
+            interval = self.refresh_interval if self.refresh() or self.ready else 60
+            self._wakeup.wait(interval)
+            self._wakeup.clear()
+
+    def descendants(self, folder_id):
+        """Full descendant closure of a folder, or None until the first crawl finishes"""
+        tree = self.tree
+        if tree is None or folder_id not in tree:
+            return None
+        return tree.descendants(folder_id)
+
+    def stats(self):
+        """Size and age of the current tree, for /api/status"""
+        tree = self.tree
+        return {
+            'ready': tree is not None,
+            'roots': len(self.roots),
+            'folders': len(tree) if tree else 0,
+            'age_seconds': round(time.time() - tree.built_at) if tree else None
+        }
+
+
+class FolderSnapshot:
+    """Process-wide folder list shared by every session, refreshed stale-while-revalidate
+
+    The first caller loads it in the foreground (concurrent first callers wait for that
+    one load), or start() runs that first load in the background and `partial` fills in
+    as folders arrive. Once it is older than max_age, callers keep getting the old list
+    while a single background refresh replaces it.
+    """
+
+    def __init__(self, loader, max_age=SNAPSHOT_MAX_AGE):
+        self._loader = loader  # loader() -> iterable of folder dicts
+        self.max_age = max_age
+        self.folders = None
+        self.partial = []  # Folders found so far by the first load
+        self.built_at = None
+        self._lock = threading.Lock()
+        self._loaded = threading.Event()
+        self._loading = False
+        self._refreshing = False
+
+    def _load(self, on_progress=None, folders=None):
+        folders = [] if folders is None else folders
+        for folder in self._loader():
+            folders.append(folder)
+            if on_progress:
+                on_progress(folders)
+        return folders
+
+    def get(self, on_progress=None):
+        """Current folder list; an empty list if the first load failed"""
+        with self._lock:
+            first_load = self.folders is None and not self._loading
+            if first_load:
+                self._loading = True
+                self._loaded.clear()
+        if first_load:
+            self._first_load(on_progress)
+        elif self.folders is None:
+            self._loaded.wait()  # Someone else is already loading it
+        elif self.age > self.max_age:
+            self.refresh_async()
+        return self.folders or []
+
+    def start(self):
+        """Run the first load on a background thread; False if it already ran or is running"""
+        with self._lock:
+            if self.folders is not None or self._loading:
+                return False
+            self._loading = True
+            self._loaded.clear()
+        threading.Thread(target=self._first_load, name='folder-snapshot', daemon=True).start()
+        return True
+
+    def _first_load(self, on_progress=None):
+        try:
+            self.partial = []
+            folders = self._load(on_progress, self.partial)
+            with self._lock:
+                self.folders, self.built_at = folders, time.time()
+        except Exception as e:
+            print(f"[FOLDER SNAPSHOT] Load failed: {e}")
+        finally:
+            with self._lock:
+                self._loading = False
+            self._loaded.set()
+
+    def refresh_async(self):
+        """Start a background refresh unless one is already running"""
+        with self._lock:
+            if self._refreshing or self._loading:
+                return False
+            self._refreshing = True
+        threading.Thread(target=self._refresh, name='folder-snapshot', daemon=True).start()
+        return True
+
+    def _refresh(self):
+        started = time.time()
+        try:
+            folders = self._load()
+            with self._lock:
+                self.folders, self.built_at = folders, time.time()
+            print(f"[FOLDER SNAPSHOT] Refreshed {len(folders)} folders in {time.time() - started:.1f}s")
+        except Exception as e:
+            print(f"[FOLDER SNAPSHOT] Refresh failed, keeping the previous list: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    @property
+    def age(self):
+        return time.time() - self.built_at if self.built_at else float('inf')
+
+    @property
+    def loading(self):
+        """True while the first load is still running"""
+        return self._loading
+
+    @property
+    def refreshing(self):
+        return self._refreshing
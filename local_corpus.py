@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+"""
+In-memory copy of the local documents folder (app/docs) for local search
+Every supported file is parsed once and its text kept in memory. A background thread
+polls the folder's modification times and re-extracts only files that were added or
+changed, dropping the ones that were removed, and keeps an optional ChunkIndex in step,
+so queries rank text that is already there (BM25 in app_flask.py, a substring match in
+simple_server.py) instead of re-reading every PDF and DOCX from disk.
+"""
+import os
+import threading
+import time
+
+DEFAULT_DOCS_DIR = os.path.join('app', 'docs')
+POLL_INTERVAL = 10  # seconds between modification-time checks
+
+
+def read_text_file(path, name, mtime=None):
+    """Default parser: plain UTF-8 text files only"""
+    if not name.lower().endswith('.txt'):
+        return None
+    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
+        return f.read()
+
+
+class LocalDocument:
+    """One parsed local file"""
+
+    __slots__ = ('name', 'path', 'mtime', 'size', 'text', '_folded')
+
+    def __init__(self, name, path, mtime, size, text):
+        self.name = name
+        self.path = path
+        self.mtime = mtime
+        self.size = size
+        self.text = text
+        self._folded = None
+
+    @property
+    def folded(self):
+        """Lower-cased text for substring matching, made on first use (the BM25 path never needs it)"""
+        if self._folded is None:
+            self._folded = self.text.lower()
+        return self._folded
+
+
+class LocalCorpus:
+    """Parsed text of every file in a folder, kept current by an mtime-polling watcher
+
+    parse(path, name, mtime) returns the file's text, or None to leave the file out
+    (unsupported type, or the parser refused it). Parse errors also leave it out until
+    the file changes again. An optional ChunkIndex is kept in step with the documents, and
+    on_change(added, changed, removed) runs after every refresh that changed something.
+    """
+
+    def __init__(self, docs_dir=DEFAULT_DOCS_DIR, parse=read_text_file, poll_interval=POLL_INTERVAL,
+                 exclude=(), index=None, on_change=None):
+        self.docs_dir = docs_dir
+        self.index = index
+        self._on_change = on_change
+        self.poll_interval = poll_interval
+        self.exclude = set(exclude)
+        self._parse = parse
+        self._documents = {}  # name -> LocalDocument
+        self._seen = {}  # name -> (mtime, size) of every file looked at, parsed or not
+        self.loaded_at = None
+        self.parsed = 0
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        """Start the watcher; its first pass loads the whole folder (safe to call repeatedly)"""
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='local-corpus', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"[LOCAL CORPUS] Refresh failed: {e}")
+            self._ready.set()  # Even a failed first pass must not block searches forever
+            time.sleep(self.poll_interval)
+
+    def refresh(self):
+        """Re-extract added/changed files and forget removed ones; returns (added, changed, removed) names"""
+        started = time.time()
+        current = {}
+        if os.path.isdir(self.docs_dir):
+            for entry in os.scandir(self.docs_dir):
+                if entry.is_file() and entry.name not in self.exclude:
+                    stat = entry.stat()
+                    current[entry.name] = (entry.path, stat.st_mtime, stat.st_size)
+
+        added, changed = [], []
+        for name, (path, mtime, size) in current.items():
+            previous = self._seen.get(name)
+            if previous == (mtime, size):
+                continue
+            (changed if previous else added).append(name)
+            self._seen[name] = (mtime, size)
+            try:
+                text = self._parse(path, name, mtime)
+            except Exception as e:
+                print(f"[LOCAL CORPUS] Could not read {name}: {e}")
+                text = None
+            self.parsed += 1
+            with self._lock:
+                if text:
+                    self._documents[name] = LocalDocument(name, path, mtime, size, text)
+                else:
+                    self._documents.pop(name, None)
+            if self.index is not None:
+                if text:
+                    self.index.add(name, text, mtime, title=name)
+                else:
+                    self.index.remove(name)
+
+        removed = [name for name in self._seen if name not in current]
+        with self._lock:
+            for name in removed:
+                self._documents.pop(name, None)
+        for name in removed:
+            del self._seen[name]
+            if self.index is not None:
+                self.index.remove(name)
+
+        self.loaded_at = time.time()
+        if added or changed or removed:
+            print(f"[LOCAL CORPUS] {len(added)} added, {len(changed)} changed, {len(removed)} removed "
+                  f"in {time.time() - started:.1f}s")
+            if self._on_change is not None:
+                self._on_change(added, changed, removed)
+        return added, changed, removed
+
+    def documents(self, wait=None):
+        """Snapshot of the parsed documents; waits up to `wait` seconds for the first load"""
+        if wait:
+            self._ready.wait(wait)
+        with self._lock:
+            return list(self._documents.values())
+
+    def search(self, query, k=10, wait=None):
+        """BM25-ranked (document, score, best chunks) for a query; needs an index. `wait` as for documents()"""
+        if wait:
+            self._ready.wait(wait)
+        ranked = ((self.get(name), score, chunks) for name, score, chunks in self.index.search(query, k))
+        return [(document, score, chunks) for document, score, chunks in ranked if document is not None]
+
+    def get(self, name):
+        with self._lock:
+            return self._documents.get(name)
+
+    def stats(self):
+        with self._lock:
+            documents = len(self._documents)
+            chars = sum(len(document.text) for document in self._documents.values())
+        return {
+            'ready': self.ready,
+            'documents': documents,
+            'chars': chars,
+            'parsed': self.parsed,
+            'loaded_at': self.loaded_at,
+            'index': self.index.stats() if self.index is not None else None
+        }
@@ -0,0 +1,292 @@
+#!/usr/bin/env python3
+"""
+BM25 inverted index used to rank local documents and mirrored Drive text
+Text is split into lower-case word tokens, stop words (from query_patterns.json) are
+dropped and the rest reduced by a light suffix-stripping stemmer, so "following up on
+internet leads" and "follow up process for internet lead" share the terms that matter.
+Postings map each term to the documents containing it and its frequency there; a query
+only touches the postings of its own terms and ranks documents with Okapi BM25, so
+documents match on any of the words, not only on the exact phrase. ChunkIndex indexes
+the chunks of each document (see chunking.py) and keeps them next to the postings, so
+a search returns the passages to show, not just the documents.
+"""
+import heapq
+import json
+import math
+import re
+import threading
+from functools import lru_cache
+
+from chunking import chunk_document
+from document_text import PagedText
+
+DEFAULT_PATTERNS_PATH = 'query_patterns.json'
+K1 = 1.2  # Term-frequency saturation
+B = 0.75  # Document-length normalization
+RRF_K = 60  # Reciprocal-rank fusion damping: rank 1 contributes 1/61, rank 10 1/70
+_TOKEN = re.compile(r"[a-z0-9]+")
+_UNSTEMMED = frozenset({'always', 'perhaps', 'series', 'species', 'news', 'sometimes', 'afterwards', 'towards'})
+
+
+def load_stop_words(path=DEFAULT_PATTERNS_PATH):
+    """The stop_words list from query_patterns.json (empty if the file is missing)"""
+    try:
+        with open(path, 'r') as f:
+            return frozenset(word.lower() for word in json.load(f).get('stop_words', []))
+    except (OSError, ValueError) as e:
+        print(f"[SEARCH INDEX] No stop words loaded from {path}: {e}")
+        return frozenset()
+
+
+@lru_cache(maxsize=100_000)
+def stem(token):
+    """Strip common English inflections: leads -> lead, following -> follow, policies -> policy"""
+    if len(token) <= 3 or token.isdigit() or token in _UNSTEMMED:
+        return token
+    if token.endswith('sses'):
+        return token[:-2]
+    if token.endswith(('ies', 'ied')):
+        return token[:-3] + 'y'
+    for suffix in ('ing', 'ed'):
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            token = token[:-len(suffix)]
+            if token[-1] == token[-2] and token[-1] not in 'lsz':  # stopped -> stop
+                token = token[:-1]
+            return token
+    if token.endswith('s') and not token.endswith(('ss', 'us', 'is')):
+        return token[:-1]
+    return token
+
+
+def tokenize(text, stop_words=frozenset()):
+    """Stemmed index terms of a text, in order"""
+    return [stem(token) for token in _TOKEN.findall(text.lower()) if token not in stop_words]
+
+
+def fuse_rankings(rankings, k=RRF_K):
+    """Reciprocal-rank fusion of best-first rankings: [(weight, [key, ...]), ...] -> {key: score}
+
+    Only positions count, so rankings scored on different scales (cosine similarity,
+    BM25 from indexes with different statistics) can be merged.
+    """
+    fused = {}
+    for weight, keys in rankings:
+        for rank, key in enumerate(keys, 1):
+            fused[key] = fused.get(key, 0.0) + weight / (k + rank)
+    return fused
+
+
+class BM25Index:
+    """Incrementally updatable inverted index ranked with Okapi BM25
+
+    Documents are identified by caller-chosen keys (file names, Drive ids); re-adding a
+    key replaces the document. An optional version per key lets callers skip unchanged files.
+    """
+
+    def __init__(self, stop_words=frozenset(), k1=K1, b=B):
+        self.stop_words = frozenset(stop_words)
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # term -> {doc number: term frequency}
+        self._doc_terms = {}  # doc number -> distinct terms, for removal
+        self._doc_lengths = {}  # doc number -> token count
+        self._total_length = 0
+        self._numbers = {}  # key -> doc number
+        self._keys = {}  # doc number -> key
+        self._versions = {}  # key -> version
+        self._next_number = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._numbers)
+
+    def __contains__(self, key):
+        return key in self._numbers
+
+    def version(self, key):
+        return self._versions.get(key)
+
+    def keys(self):
+        with self._lock:
+            return list(self._numbers)
+
+    def add(self, key, text, version=None):
+        """Index (or re-index) one document"""
+        frequencies = {}
+        for term in tokenize(text, self.stop_words):
+            frequencies[term] = frequencies.get(term, 0) + 1
+        with self._lock:
+            self._remove(key)
+            number = self._next_number
+            self._next_number += 1
+            for term, count in frequencies.items():
+                self._postings.setdefault(term, {})[number] = count
+            self._doc_terms[number] = tuple(frequencies)
+            length = sum(frequencies.values())
+            self._doc_lengths[number] = length
+            self._total_length += length
+            self._numbers[key] = number
+            self._keys[number] = key
+            self._versions[key] = version
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        number = self._numbers.pop(key, None)
+        if number is None:
+            return
+        del self._keys[number]
+        self._versions.pop(key, None)
+        for term in self._doc_terms.pop(number):
+            postings = self._postings[term]
+            del postings[number]
+            if not postings:
+                del self._postings[term]
+        self._total_length -= self._doc_lengths.pop(number)
+
+    def search(self, query, k=10, accept=None):
+        """Top-k (key, score) pairs for a free-text query, best first
+
+        accept(key) can restrict results (e.g. to files under one folder).
+        """
+        terms = set(tokenize(query, self.stop_words))
+        with self._lock:
+            count = len(self._numbers)
+            if not terms or not count:
+                return []
+            average_length = self._total_length / count or 1
+            scores = {}
+            for term in terms:
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for number, frequency in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_lengths[number] / average_length)
+                    scores[number] = scores.get(number, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+            ranked = ((score, self._keys[number]) for number, score in scores.items())
+            if accept is not None:
+                ranked = ((score, key) for score, key in ranked if accept(key))
+            best = heapq.nlargest(k, ranked) if k else sorted(ranked, reverse=True)
+        return [(key, score) for score, key in best]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'documents': len(self._numbers),
+                'terms': len(self._postings)
+            }
+
+
+class ChunkIndex:
+    """BM25 over document chunks; chunks are cut once when a document is added and kept here"""
+
+    def __init__(self, stop_words=frozenset(), chunk_chars=None, overlap=None):
+        self.index = BM25Index(stop_words)
+        self.chunk_options = {name: value for name, value in
+                              (('chunk_chars', chunk_chars), ('overlap', overlap)) if value is not None}
+        self._chunks = {}  # chunk id -> Chunk
+        self._documents = {}  # key -> (version, chunk ids)
+        self._pages = {}  # key -> (offsets, unit) for PagedText documents
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._documents)
+
+    def __contains__(self, key):
+        return key in self._documents
+
+    def version(self, key):
+        entry = self._documents.get(key)
+        return entry[0] if entry else None
+
+    def keys(self):
+        with self._lock:
+            return list(self._documents)
+
+    def all_chunks(self):
+        """Every indexed chunk, document by document"""
+        with self._lock:
+            return [self._chunks[chunk_id] for _, chunk_ids in self._documents.values() for chunk_id in chunk_ids]
+
+    def chunks(self, key):
+        """A document's chunks in reading order"""
+        with self._lock:
+            entry = self._documents.get(key)
+            return [self._chunks[chunk_id] for chunk_id in entry[1]] if entry else []
+
+    def text(self, key):
+        """A document's text put back together from its chunks (None if it is not indexed)
+
+        Characters keep their original offsets - the whitespace between chunks comes back
+        as newlines - so a PagedText document is returned as PagedText with its page offsets.
+        """
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is None:
+                return None
+            chunks = [self._chunks[chunk_id] for chunk_id in entry[1]]
+            pages = self._pages.get(key)
+        parts, end = [], 0
+        for chunk in chunks:
+            if chunk.start >= end:
+                parts.append("\n" * (chunk.start - end))
+                parts.append(chunk.text)
+            elif chunk.end > end:  # Overlaps the previous chunk - keep only the new part
+                parts.append(chunk.text[end - chunk.start:])
+            end = max(end, chunk.end)
+        text = "".join(parts)
+        return PagedText(text, *pages) if pages else text
+
+    def add(self, key, text, version=None, title=''):
+        """Chunk and index one document, replacing any earlier version; title is indexed with every chunk"""
+        chunks = chunk_document(key, text, **self.chunk_options)
+        self.remove(key)
+        with self._lock:
+            for chunk in chunks:
+                self._chunks[chunk.id] = chunk
+            self._documents[key] = (version, [chunk.id for chunk in chunks])
+            if isinstance(text, PagedText) and text.offsets:
+                self._pages[key] = (text.offsets, text.unit)
+        for chunk in chunks:
+            self.index.add(chunk.id, f"{title}\n{chunk.heading or ''}\n{chunk.text}")
+
+    def remove(self, key):
+        with self._lock:
+            entry = self._documents.pop(key, None)
+            self._pages.pop(key, None)
+            chunk_ids = entry[1] if entry else []
+            for chunk_id in chunk_ids:
+                self._chunks.pop(chunk_id, None)
+        for chunk_id in chunk_ids:
+            self.index.remove(chunk_id)
+
+    def search(self, query, k=10, accept=None, chunks_per_document=3):
+        """Top-k (key, score, chunks) for a query; a document scores as its best chunk
+
+        chunks are the document's best-matching chunks, best first. accept(key) filters documents.
+        """
+        chunks = self._chunks
+
+        def accept_chunk(chunk_id):
+            chunk = chunks.get(chunk_id)
+            return chunk is not None and accept(chunk.key)
+
+        documents = {}  # key -> [score, chunks]
+        for chunk_id, score in self.index.search(query, None, accept_chunk if accept is not None else None):
+            chunk = chunks.get(chunk_id)
+            if chunk is None:  # Removed while searching
+                continue
+            entry = documents.setdefault(chunk.key, [score, []])
+            if len(entry[1]) < chunks_per_document:
+                entry[1].append(chunk)
+        ranked = sorted(documents.items(), key=lambda item: item[1][0], reverse=True)
+        return [(key, score, best) for key, (score, best) in (ranked[:k] if k else ranked)]
+
+    def stats(self):
+        stats = self.index.stats()
+        stats['documents'] = len(self._documents)
+        stats['chunks'] = len(self._chunks)
+        return stats
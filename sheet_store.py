@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+Columnar store of spreadsheet tables shared by the Flask and Streamlit apps
+Dealer reports arrive as XLSX workbooks. Each sheet is kept as typed NumPy columns -
+float64 for numbers, datetime64[D] for dates, and int32 codes into a string dictionary
+for text - persisted as one .npz file per Drive file and keyed by its revision. A new
+revision overwrites the file, and the least recently used files are removed once the
+store outgrows its byte budget. Filters and aggregates run as vectorized scans over
+those columns, so a question such as "how many leads did Pierre Ford get in July" is
+answered from the table instead of pasting rows into the LLM prompt. Text filters only
+compare against the (small) dictionary.
+"""
+import datetime
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+try:
+    import numpy as np
+except ImportError:  # The apps still run; spreadsheets just get no columnar tables
+    np = None
+
+DEFAULT_STORE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.sheet_store')
+MAX_ROWS = 200_000  # Rows kept per sheet
+MEMORY_ENTRIES = 32  # Workbooks kept loaded in memory
+DEFAULT_MAX_BYTES = 500 * 1024 * 1024  # Disk budget for all .npz files
+MISSING = -1  # Dictionary code of an empty text cell
+AGGREGATES = ('count', 'sum', 'mean', 'min', 'max', 'distinct')
+
+
+class SheetQueryError(ValueError):
+    """A filter or aggregate referred to an unknown column, operator or function"""
+
+
+class Column:
+    """One typed column: 'number' (float64, NaN = empty), 'date' (datetime64[D], NaT = empty) or 'text'"""
+
+    def __init__(self, name, kind, values, labels=None):
+        self.name = name
+        self.kind = kind
+        self.values = values  # For text: int32 codes into labels, MISSING for empty cells
+        self.labels = labels  # Text dictionary (numpy unicode array), None for other kinds
+
+    @classmethod
+    def from_cells(cls, name, cells):
+        """Pick the narrowest type that fits every non-empty cell"""
+        present = [cell for cell in cells if cell is not None and cell != ""]
+        if present and all(isinstance(cell, (int, float)) and not isinstance(cell, bool) for cell in present):
+            values = np.array([np.nan if cell is None or cell == "" else cell for cell in cells], dtype=np.float64)
+            return cls(name, 'number', values)
+        if present and all(isinstance(cell, (datetime.date, datetime.datetime)) for cell in present):
+            values = np.array([None if cell is None or cell == "" else
+                               (cell.date() if isinstance(cell, datetime.datetime) else cell) for cell in cells],
+                              dtype='datetime64[D]')
+            return cls(name, 'date', values)
+        text = np.array(["" if cell is None else str(cell).strip() for cell in cells], dtype=str)
+        labels, codes = np.unique(text, return_inverse=True)
+        codes = codes.astype(np.int32)
+        if len(labels) and labels[0] == "":  # "" sorts first - turn it into the missing code
+            labels = labels[1:]
+            codes -= 1
+        return cls(name, 'text', codes, labels)
+
+    def present(self):
+        """Boolean mask of non-empty cells"""
+        if self.kind == 'number':
+            return ~np.isnan(self.values)
+        if self.kind == 'date':
+            return ~np.isnat(self.values)
+        return self.values != MISSING
+
+    def mask(self, op, value):
+        """Boolean mask of rows where `column op value` holds"""
+        if self.kind == 'text':
+            return self._text_mask(op, value)
+        if op in ('month', 'year'):
+            if self.kind != 'date':
+                raise SheetQueryError(f"'{op}' needs a date column, '{self.name}' is {self.kind}")
+            unit = 'M' if op == 'month' else 'Y'
+            periods = self.values.astype(f'datetime64[{unit}]').astype(np.int64)
+            parts = periods % 12 + 1 if op == 'month' else periods + 1970
+            return self.present() & (parts == _month_number(value) if op == 'month' else parts == _as_year(value))
+        target = np.datetime64(_as_date(value), 'D') if self.kind == 'date' else _as_number(value, self.name)
+        return self.present() & _compare(self.values, op, target)
+
+    def _text_mask(self, op, value):
+        # Evaluate against the dictionary once, then select rows by code
+        labels = np.char.lower(self.labels) if len(self.labels) else self.labels
+        needle = str(value).strip().lower()
+        if op in ('==', '!='):
+            matches = labels == needle
+        elif op == 'contains':
+            matches = np.char.find(labels, needle) >= 0 if len(labels) else np.zeros(0, dtype=bool)
+        elif op == 'in':
+            if not isinstance(value, (list, tuple)):
+                raise SheetQueryError(f"'in' needs a list of values for column '{self.name}'")
+            matches = np.isin(labels, [str(item).strip().lower() for item in value])
+        else:
+            raise SheetQueryError(f"Operator '{op}' does not apply to text column '{self.name}'")
+        selected = np.isin(self.values, np.flatnonzero(matches))
+        return ~selected & self.present() if op == '!=' else selected
+
+    def cell(self, index):
+        """The value at a row as a plain Python object"""
+        if self.kind == 'text':
+            code = self.values[index]
+            return None if code == MISSING else str(self.labels[code])
+        value = self.values[index]
+        if self.kind == 'date':
+            return None if np.isnat(value) else str(value)
+        return None if np.isnan(value) else float(value)
+
+
+class SheetTable:
+    """A sheet as named columns of equal length"""
+
+    def __init__(self, name, columns, truncated=False):
+        self.name = name
+        self.columns = OrderedDict((column.name, column) for column in columns)
+        self.rows = len(columns[0].values) if columns else 0
+        self.truncated = truncated  # True when the sheet had more than MAX_ROWS rows
+
+    def column(self, name):
+        """Look a column up by name, ignoring case and surrounding spaces"""
+        if not isinstance(name, str):
+            raise SheetQueryError(f"Column names must be strings, got {name!r}")
+        if name in self.columns:
+            return self.columns[name]
+        wanted = str(name).strip().lower()
+        for column_name, column in self.columns.items():
+            if column_name.strip().lower() == wanted:
+                return column
+        raise SheetQueryError(f"No column '{name}' in sheet '{self.name}'")
+
+    def mask(self, filters=()):
+        """Rows matching every (column, op, value) filter"""
+        mask = np.ones(self.rows, dtype=bool)
+        for condition in filters:
+            if not isinstance(condition, (list, tuple)) or len(condition) != 3:
+                raise SheetQueryError(f"Filter {condition!r} must be [column, operator, value]")
+            column, op, value = condition
+            mask &= self.column(column).mask(op, value)
+        return mask
+
+    def aggregate(self, function='count', column=None, filters=(), group_by=None):
+        """count/sum/mean/min/max/distinct of a column over the filtered rows, optionally per group
+
+        Returns a number, or a {group: number} dict when group_by names a text column.
+        """
+        if function not in AGGREGATES:
+            raise SheetQueryError(f"Unknown aggregate '{function}' - use one of {', '.join(AGGREGATES)}")
+        if column is None and function != 'count':
+            raise SheetQueryError(f"'{function}' needs a column")
+        mask = self.mask(filters)
+        target = self.column(column) if column else None
+        if target is not None and function in ('sum', 'mean') and target.kind != 'number':
+            raise SheetQueryError(f"Cannot {function} text/date column '{target.name}'")
+        if target is not None:
+            mask &= target.present()
+
+        if group_by is None:
+            return _reduce(function, target, mask)
+        groups = self.column(group_by)
+        if groups.kind != 'text':
+            raise SheetQueryError(f"Group-by column '{groups.name}' must be text")
+        mask &= groups.present()
+        if function == 'count':
+            counts = np.bincount(groups.values[mask], minlength=len(groups.labels))
+            return {str(groups.labels[code]): int(count) for code, count in enumerate(counts) if count}
+        if function in ('sum', 'mean'):
+            sums = np.bincount(groups.values[mask], weights=target.values[mask], minlength=len(groups.labels))
+            if function == 'sum':
+                present = np.bincount(groups.values[mask], minlength=len(groups.labels)) > 0
+                return {str(groups.labels[code]): float(sums[code]) for code in np.flatnonzero(present)}
+            counts = np.bincount(groups.values[mask], minlength=len(groups.labels))
+            return {str(groups.labels[code]): float(sums[code] / counts[code]) for code in np.flatnonzero(counts)}
+        return {str(groups.labels[code]): _reduce(function, target, mask & (groups.values == code))
+                for code in np.unique(groups.values[mask])}
+
+    def rows_where(self, filters=(), limit=20):
+        """The first `limit` matching rows as dicts - for showing the evidence behind an answer"""
+        indexes = np.flatnonzero(self.mask(filters))[:limit]
+        return [{name: column.cell(index) for name, column in self.columns.items()} for index in indexes]
+
+    def describe(self):
+        """Column names, types and sizes - small enough to hand to the LLM instead of the rows"""
+        columns = []
+        for name, column in self.columns.items():
+            entry = {'name': name, 'type': column.kind}
+            if column.kind == 'text':
+                entry['distinct'] = len(column.labels)
+                if len(column.labels) <= 20:
+                    entry['values'] = [str(label) for label in column.labels]
+            columns.append(entry)
+        return {'sheet': self.name, 'rows': self.rows, 'truncated': self.truncated, 'columns': columns}
+
+
+def _compare(values, op, target):
+    if op == '==':
+        return values == target
+    if op == '!=':
+        return values != target
+    if op == '<':
+        return values < target
+    if op == '<=':
+        return values <= target
+    if op == '>':
+        return values > target
+    if op == '>=':
+        return values >= target
+    raise SheetQueryError(f"Unknown operator '{op}'")
+
+
+def _reduce(function, column, mask):
+    if function == 'count':
+        return int(mask.sum())
+    if function == 'distinct':
+        return int(len(np.unique(column.values[mask])))
+    if not mask.any():
+        return None
+    values = column.values[mask]
+    if function == 'sum':
+        return float(values.sum())
+    if function == 'mean':
+        return float(values.mean())
+    if column.kind == 'text':  # The dictionary is sorted, so code order is label order
+        return str(column.labels[values.min() if function == 'min' else values.max()])
+    result = values.min() if function == 'min' else values.max()
+    return str(result) if column.kind == 'date' else float(result)
+
+
+_MONTHS = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+
+
+def _month_number(value):
+    """7, '7', 'July' or 'jul' -> 7"""
+    if isinstance(value, str) and not value.strip().isdigit():
+        month = _MONTHS.get(value.strip().lower()[:3])
+        if month is None:
+            raise SheetQueryError(f"Unknown month '{value}'")
+        return month
+    try:
+        month = int(value)
+    except (TypeError, ValueError):
+        raise SheetQueryError(f"Unknown month '{value}'")
+    if not 1 <= month <= 12:
+        raise SheetQueryError(f"Unknown month '{value}'")
+    return month
+
+
+def _as_year(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise SheetQueryError(f"'{value}' is not a year")
+
+
+def _as_number(value, column_name):
+    if not isinstance(value, bool):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            pass
+    raise SheetQueryError(f"'{value}' is not a number (column '{column_name}' is numeric)")
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    try:
+        return datetime.date.fromisoformat(str(value)[:10])
+    except ValueError:
+        raise SheetQueryError(f"'{value}' is not a date - use YYYY-MM-DD")
+
+
+def read_sheet_tables(source, max_rows=MAX_ROWS):
+    """Columnar tables for every sheet of an .xlsx (file path or bytes), read in one streaming pass
+
+    The first non-empty row of a sheet is its header; sheets with no data rows are skipped.
+    """
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(io.BytesIO(source) if isinstance(source, bytes) else source,
+                             read_only=True, data_only=True)
+    tables = []
+    try:
+        for sheet in workbook.worksheets:
+            header = None
+            cells = []
+            truncated = False
+            for values in sheet.iter_rows(values_only=True):
+                if not any(value is not None and str(value).strip() for value in values):
+                    continue
+                if header is None:
+                    header = _column_names(values)
+                    cells = [[] for _ in header]
+                    continue
+                if len(cells[0]) >= max_rows:
+                    truncated = True
+                    break
+                for index, column in enumerate(cells):
+                    column.append(values[index] if index < len(values) else None)
+            if header and cells[0]:
+                columns = [Column.from_cells(name, column) for name, column in zip(header, cells)]
+                tables.append(SheetTable(sheet.title, columns, truncated))
+    finally:
+        workbook.close()
+    return tables
+
+
+def _column_names(values):
+    """Header cells as unique column names ('Column N' for blanks, 'Name (2)' for repeats)"""
+    names = []
+    for index, value in enumerate(values):
+        name = str(value).strip() if value is not None and str(value).strip() else f"Column {index + 1}"
+        base, copy = name, 2
+        while name in names:
+            name = f"{base} ({copy})"
+            copy += 1
+        names.append(name)
+    return names
+
+
+class SheetStore:
+    """Columnar tables per Drive file revision, as size-bounded .npz files on disk with a small in-memory LRU"""
+
+    def __init__(self, store_dir=DEFAULT_STORE_DIR, memory_entries=MEMORY_ENTRIES, max_bytes=DEFAULT_MAX_BYTES):
+        self.store_dir = store_dir
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.builds = 0
+        self.evictions = 0
+        self._loaded = OrderedDict()  # file_id -> (version, tables)
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return np is not None
+
+    def _path(self, file_id):
+        return os.path.join(self.store_dir, re.sub(r'[^A-Za-z0-9_.-]', '_', str(file_id)) + '.npz')
+
+    def get(self, file_id, version=None):
+        """Tables of a file, or None if it was never stored or the stored revision differs
+
+        version=None accepts whichever revision is stored.
+        """
+        if not self.available:
+            return None
+        with self._lock:
+            entry = self._loaded.get(file_id)
+            if entry is not None and (version is None or entry[0] == version):
+                self._loaded.move_to_end(file_id)
+                self.hits += 1
+                self._touch(file_id)
+                return entry[1]
+        entry = self._read(file_id)
+        if entry is None or (version is not None and entry[0] != version):
+            self.misses += 1
+            return None
+        self._remember(file_id, *entry)
+        self.hits += 1
+        self._touch(file_id)
+        return entry[1]
+
+    def version(self, file_id):
+        """Revision of the stored tables, or None"""
+        with self._lock:
+            entry = self._loaded.get(file_id)
+        if entry is None:
+            entry = self._read(file_id)
+        return entry[0] if entry else None
+
+    def put(self, file_id, version, tables):
+        """Persist the tables of one file revision, replacing any earlier revision"""
+        if not self.available:
+            return
+        manifest = {'version': version, 'sheets': []}
+        arrays = {}
+        for sheet_index, table in enumerate(tables):
+            sheet = {'name': table.name, 'truncated': table.truncated, 'columns': []}
+            for column_index, column in enumerate(table.columns.values()):
+                key = f"s{sheet_index}c{column_index}"
+                arrays[key] = column.values
+                if column.labels is not None:
+                    arrays[key + 'labels'] = column.labels
+                sheet['columns'].append({'name': column.name, 'kind': column.kind, 'key': key})
+            manifest['sheets'].append(sheet)
+        arrays['manifest'] = np.array(json.dumps(manifest))
+
+        os.makedirs(self.store_dir, exist_ok=True)
+        path = self._path(file_id)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                np.savez(f, **arrays)
+            os.replace(temp_path, path)  # Readers never see a half-written file; the old revision is gone
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._remember(file_id, version, tables)
+        self.builds += 1
+        self._evict(keep=path)
+
+    def _touch(self, file_id):
+        """Mark a file as recently used - eviction goes by modification time"""
+        try:
+            os.utime(self._path(file_id))
+        except OSError:
+            pass
+
+    def _evict(self, keep=None):
+        """Remove least recently used .npz files until the store fits its byte budget"""
+        if not self.max_bytes:
+            return
+        try:
+            entries = [entry for entry in os.scandir(self.store_dir) if entry.name.endswith('.npz')]
+            files = sorted(((entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in entries))
+        except OSError as e:
+            print(f"[SHEET STORE] Could not check the store size: {e}")
+            return
+        total = sum(size for _, size, _ in files)
+        for _, size, path in files:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def invalidate(self, file_id):
+        with self._lock:
+            self._loaded.pop(file_id, None)
+        try:
+            os.remove(self._path(file_id))
+        except OSError:
+            pass
+
+    def _read(self, file_id):
+        try:
+            with np.load(self._path(file_id), allow_pickle=False) as data:
+                manifest = json.loads(str(data['manifest']))
+                tables = []
+                for sheet in manifest['sheets']:
+                    columns = [Column(column['name'], column['kind'], data[column['key']],
+                                      data[column['key'] + 'labels'] if column['kind'] == 'text' else None)
+                               for column in sheet['columns']]
+                    tables.append(SheetTable(sheet['name'], columns, sheet['truncated']))
+            return manifest['version'], tables
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[SHEET STORE] Ignoring unreadable tables for {file_id}: {e}")
+            return None
+
+    def _remember(self, file_id, version, tables):
+        with self._lock:
+            self._loaded[file_id] = (version, tables)
+            self._loaded.move_to_end(file_id)
+            while len(self._loaded) > self.memory_entries:
+                self._loaded.popitem(last=False)
+
+    def query(self, file_id, sheet=None, function='count', column=None, filters=(), group_by=None):
+        """Run one aggregate against a stored file (first sheet unless `sheet` names one)"""
+        tables = self.get(file_id)
+        if not tables:
+            raise SheetQueryError(f"No spreadsheet tables stored for {file_id}")
+        table = tables[0]
+        if sheet is not None:
+            table = next((t for t in tables if t.name.strip().lower() == str(sheet).strip().lower()), None)
+            if table is None:
+                raise SheetQueryError(f"No sheet '{sheet}' in {file_id}")
+        if not isinstance(filters, (list, tuple)):
+            raise SheetQueryError("filters must be a list of [column, operator, value] filters")
+        return table.aggregate(function, column, filters, group_by)
+
+    def stats(self):
+        with self._lock:
+            loaded = len(self._loaded)
+        return {
+            'available': self.available,
+            'loaded': loaded,
+            'hits': self.hits,
+            'misses': self.misses,
+            'builds': self.builds,
+            'evictions': self.evictions
+        }
+
+
+# Process-wide store used by both apps
+sheet_store = SheetStore(os.environ.get('SHEET_STORE_DIR', DEFAULT_STORE_DIR),
+                         max_bytes=int(os.environ.get('SHEET_STORE_MAX_MB', DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024)
@@ -7,28 +7,25 @@ from http.server import BaseHTTPRequestHandler, HTTPServer
 from urllib.parse import urlparse, parse_qs, unquote
 import os
 import json
+from local_corpus import LocalCorpus
+
+# Only .txt files here - the default parser skips everything else
+corpus = LocalCorpus("app/docs")
 
 class SimpleHandler(BaseHTTPRequestHandler):
     def search_docs(self, query):
         """Search documents"""
-        docs_path = "app/docs"
         results = []
+        needle = query.lower()
         
-        if os.path.exists(docs_path):
-            for filename in os.listdir(docs_path):
-                if filename.endswith('.txt'):
-                    filepath = os.path.join(docs_path, filename)
-                    try:
-                        with open(filepath, 'r', encoding='utf-8') as f:
-                            content = f.read()
-                            if query.lower() in content.lower():
-                                index = content.lower().find(query.lower())
-                                start = max(0, index - 100)
-                                end = min(len(content), index + 200)
-                                snippet = content[start:end].strip()
-                                results.append(f"From {filename}: {snippet}")
-                    except:
-                        pass
+        # Text files are held in memory and refreshed by the corpus watcher
+        for document in corpus.documents(wait=10):
+            if needle in document.folded:
+                index = document.folded.find(needle)
+                start = max(0, index - 100)
+                end = min(len(document.text), index + 200)
+                snippet = document.text[start:end].strip()
+                results.append(f"From {document.name}: {snippet}")
         
         if results:
             return " ".join(results[:2])
@@ -61,6 +58,7 @@ class SimpleHandler(BaseHTTPRequestHandler):
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 8080))
+    corpus.start()
     server = HTTPServer(('0.0.0.0', port), SimpleHandler)
     print(f"Server running on port {port}")
     server.serve_forever()
\ No newline at end of file
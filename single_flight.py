@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+In-flight request coalescing ("single flight") shared by the Flask and Streamlit apps
+When several threads ask for the same key at once, only the first runs the work; the
+others wait for it and receive the same result (or the same exception). Used to make
+concurrent questions about one Drive file share a single download and extraction.
+"""
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls that share a key into one execution"""
+
+    def __init__(self):
+        self.executed = 0  # calls that did the work
+        self.coalesced = 0  # calls that waited on someone else's work
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        """Run fn(*args, **kwargs) unless a call for key is already in flight, then share its outcome"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn(*args, **kwargs)
+            except BaseException as e:
+                call.error = e
+            finally:
+                # Forget the key first so later callers start fresh work instead of reusing this result
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.done.set()
+        else:
+            call.done.wait()
+
+        if call.error is not None:
+            raise call.error
+        return call.result
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            'executed': self.executed,
+            'coalesced': self.coalesced,
+            'in_flight': in_flight
+        }
+
+
+# Process-wide coalescing of Drive file downloads/extractions, keyed by (file id, revision)
+drive_downloads = SingleFlight()
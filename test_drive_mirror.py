@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Tests for the incremental Drive mirror, replaying change feeds through FakeDriveService
+Run with: python -m pytest test_drive_mirror.py
+"""
+from document_text import join_segments
+from drive_sync import DriveMirror
+from fake_drive import FakeDriveService
+from search_index import ChunkIndex
+from text_cache import TextCache
+
+ROOT = 'root-playbooks'
+
+
+def make_mirror(tmp_path, drive, max_bytes=10 * 1024 * 1024, extracted=None):
+    def extract(service, meta):
+        if extracted is not None:
+            extracted.append(meta['id'])
+        return drive.extract(service, meta)
+
+    return DriveMirror(lambda: drive, {ROOT: 'Playbooks'}, extract,
+                       state_path=str(tmp_path / 'mirror.json'),
+                       text_store=TextCache(str(tmp_path / 'cache'), max_bytes))
+
+
+def found(mirror, terms, folder_id=ROOT):
+    return {meta['name'] for meta, _, _, _ in mirror.search(terms, folder_id)}
+
+
+def seeded_drive():
+    drive = FakeDriveService()
+    drive.add_folder(ROOT, 'Playbooks')
+    drive.add_folder('sales', 'Sales', ROOT)
+    drive.add_folder('outside', 'Personal')
+    drive.add_file('leads', 'Internet Leads.txt', 'sales', "Respond to every internet lead within five minutes.")
+    drive.add_file('trade', 'Trade Appraisal.txt', ROOT, "Appraise each trade in before quoting a payment.")
+    return drive
+
+
+def test_bootstrap_mirrors_only_tracked_folders(tmp_path):
+    drive = seeded_drive()
+    drive.add_file('notes', 'Notes.txt', 'outside', "Internet lead notes kept outside the playbooks.")
+    mirror = make_mirror(tmp_path, drive)
+    mirror.sync()
+    assert mirror.ready
+    assert set(mirror.files) == {'leads', 'trade'}
+    assert found(mirror, "internet lead") == {'Internet Leads.txt'}
+    assert found(mirror, "internet lead", 'sales') == {'Internet Leads.txt'}
+
+
+def test_change_feed_add_update_move_in_and_trash(tmp_path):
+    drive = seeded_drive()
+    extracted = []
+    mirror = make_mirror(tmp_path, drive, extracted=extracted)
+    mirror.sync()
+    del extracted[:]
+
+    drive.replay([
+        {'op': 'add_file', 'file_id': 'service', 'name': 'Service Recalls.txt', 'parent': 'sales',
+         'content': "Check open recalls when a customer books service."},
+        {'op': 'update_file', 'file_id': 'leads',
+         'content': "Call every internet lead back within ten minutes, then text."},
+        {'op': 'add_folder', 'folder_id': 'finance', 'name': 'Finance', 'parent': 'outside'},
+        {'op': 'trash', 'file_id': 'trade'},
+    ])
+    drive.add_file('warranty', 'Extended Warranty.txt', 'finance', "Offer the extended warranty on every deal.")
+    assert mirror.sync() == 3  # service, leads, warranty (added while its folder was untracked)
+    assert found(mirror, "warranty") == set()
+
+    drive.move('finance', ROOT)  # The folder and its existing file move into the tree
+    mirror.sync()
+
+    assert set(mirror.files) == {'leads', 'service', 'warranty'}
+    assert found(mirror, "recalls") == {'Service Recalls.txt'}
+    assert found(mirror, "ten minutes") == {'Internet Leads.txt'}
+    assert found(mirror, "five") == set()
+    assert found(mirror, "appraise trade") == set()
+    assert found(mirror, "extended warranty") == {'Extended Warranty.txt'}
+    # Only new or changed revisions were extracted
+    assert sorted(extracted) == ['leads', 'service', 'warranty']
+
+    # Nothing changed: a sync extracts nothing
+    del extracted[:]
+    assert mirror.sync() == 0
+    assert extracted == []
+
+
+def test_files_evicted_from_text_cache_stay_searchable(tmp_path):
+    drive = FakeDriveService()
+    drive.add_folder(ROOT, 'Playbooks')
+    topics = ['leads', 'trades', 'service', 'finance', 'recalls']
+    for topic in topics:
+        drive.add_file(topic, f"{topic}.txt", ROOT, f"The {topic} playbook explains the {topic} process in detail.")
+    mirror = make_mirror(tmp_path, drive, max_bytes=150)  # Room for only two of the five texts
+    mirror.sync()
+    mirror.sync()
+
+    assert mirror.text_store.evictions > 0
+    for topic in topics:
+        matches = mirror.search(topic, ROOT)
+        assert [meta['name'] for meta, _, _, _ in matches][:1] == [f"{topic}.txt"]
+        assert f"{topic} process" in matches[0][1]
+
+
+def test_evicted_before_indexing_is_extracted_again(tmp_path):
+    drive = seeded_drive()
+    mirror = make_mirror(tmp_path, drive)
+    mirror.sync()
+    mirror.index.remove('trade')  # As if the text was extracted but evicted before it was indexed
+    mirror.text_store.invalidate('trade')
+
+    mirror.sync()
+
+    assert found(mirror, "appraise") == {'Trade Appraisal.txt'}
+
+
+def test_restart_is_not_ready_until_the_sync_thread_rebuilds_the_index(tmp_path):
+    drive = seeded_drive()
+    make_mirror(tmp_path, drive).sync()
+
+    extracted = []
+    restarted = make_mirror(tmp_path, drive, extracted=extracted)
+    assert restarted.load_state()
+    assert not restarted.ready
+    assert found(restarted, "internet lead") == set()  # Searches only read the index
+    assert len(restarted.index) == 0
+
+    assert restarted.sync() == 0
+    assert restarted.ready
+    assert found(restarted, "internet lead") == {'Internet Leads.txt'}
+    assert extracted == []  # Rebuilt from the text store, not from Drive
+
+
+def test_rebuilt_text_keeps_offsets_and_pages():
+    pages = ["Internet leads are answered within five minutes.\n\n",
+             "Trade appraisals come before any payment is quoted.\n",
+             "Service customers hear about open recalls."]
+    text = join_segments(pages)
+    index = ChunkIndex(chunk_chars=60, overlap=30)
+    index.add('handbook', text, 'v1')
+
+    rebuilt = index.text('handbook')
+    assert rebuilt.strip() == text.strip()
+    assert list(rebuilt.offsets) == list(text.offsets)
+    assert rebuilt.locate(rebuilt.index("recalls")) == 3
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Tests for the extraction process pool's limits
+Run with: python -m pytest test_extraction_pool.py
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from extraction_pool import ExtractionPool
+
+PARSE_SECONDS = 1.0
+
+
+def slow_document(path, seconds=PARSE_SECONDS):
+    """A FIFO whose parse takes `seconds` once a worker opens it - the clock starts at pick-up, not submit"""
+    os.mkfifo(path)
+
+    def write():
+        with open(path, 'wb') as f:  # Blocks until the worker opens the FIFO
+            time.sleep(seconds)
+            f.write(b"Parsed after waiting in the queue.")
+
+    threading.Thread(target=write, daemon=True).start()
+    return path
+
+
+@pytest.mark.skipif(not hasattr(os, 'mkfifo'), reason="needs FIFOs")
+def test_time_queued_behind_other_documents_is_not_a_timeout(tmp_path):
+    pool = ExtractionPool(max_workers=1, hard_timeout=2)
+    count = 9  # The last document waits about 8s in the queue, well past hard_timeout + any slack
+    paths = [slow_document(str(tmp_path / f"doc{number}.txt")) for number in range(count)]
+    try:
+        with ThreadPoolExecutor(count) as callers:
+            texts = list(callers.map(lambda path: pool.parse(path, 'txt'), paths))
+    finally:
+        pool.shutdown()
+
+    assert texts == ["Parsed after waiting in the queue."] * count
+    assert pool.stats()['failed'] == 0
+    assert pool.stats()['restarts'] == 0
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Disk-backed extracted-text cache shared by the Flask and Streamlit apps
+Entries are keyed by Drive file id + revision (md5Checksum or modifiedTime), so an
+unchanged file is never downloaded or parsed twice. The store is size-bounded and
+evicts least-recently-used entries once it grows past its byte budget. Page/paragraph
+offsets of PagedText are stored next to the text as a packed uint32 array.
+"""
+import os
+import sqlite3
+import threading
+import time
+from array import array
+
+from document_text import PagedText
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.text_cache')
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024  # 200MB - roughly 2000 large playbooks
+
+
+def file_version(file_meta):
+    """Return the revision marker for a Drive file (md5Checksum, else modifiedTime)"""
+    if not file_meta:
+        return None
+    return file_meta.get('md5Checksum') or file_meta.get('modifiedTime')
+
+
+class TextCache:
+    """LRU-evicted store of extracted document text, persisted in SQLite"""
+
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _db(self):
+        """Open the database lazily so importing the module has no side effects"""
+        if self._conn is None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            conn = sqlite3.connect(os.path.join(self.cache_dir, 'text_cache.db'),
+                                   timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                                file_id TEXT PRIMARY KEY,
+                                version TEXT NOT NULL,
+                                text TEXT NOT NULL,
+                                size INTEGER NOT NULL,
+                                last_access REAL NOT NULL,
+                                offsets BLOB,
+                                unit TEXT)""")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if 'offsets' not in columns:  # Cache created before offsets were stored
+                conn.execute("ALTER TABLE entries ADD COLUMN offsets BLOB")
+                conn.execute("ALTER TABLE entries ADD COLUMN unit TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_lru ON entries (last_access)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS quarantine (
+                                file_id TEXT PRIMARY KEY,
+                                version TEXT NOT NULL,
+                                reason TEXT NOT NULL,
+                                recorded_at REAL NOT NULL)""")
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def get(self, file_id, version):
+        """Return cached text for this file revision, or None on a miss"""
+        if not file_id or not version:
+            # Without a revision marker we cannot tell whether the text is stale
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            try:
+                db = self._db()
+                row = db.execute("SELECT text, offsets, unit FROM entries WHERE file_id = ? AND version = ?",
+                                 (file_id, version)).fetchone()
+                if row is None:
+                    self.misses += 1
+                    return None
+                db.execute("UPDATE entries SET last_access = ? WHERE file_id = ?",
+                           (time.time(), file_id))
+                db.commit()
+                self.hits += 1
+                text, packed, unit = row
+                if packed is None:
+                    return text
+                offsets = array('I')
+                offsets.frombytes(packed)
+                return PagedText(text, offsets, unit or 'page')
+            except sqlite3.Error as e:
+                print(f"[TEXT CACHE] Read error for {file_id}: {e}")
+                self.misses += 1
+                return None
+
+    def put(self, file_id, version, text):
+        """Store text for a file revision, replacing any older revision of the same file
+
+        PagedText keeps its page/paragraph offsets, which get() hands back.
+        """
+        if not file_id or not version or text is None:
+            return
+        offsets = getattr(text, 'offsets', None)
+        packed = offsets.tobytes() if offsets else None
+        size = len(text.encode('utf-8')) + (len(packed) if packed else 0)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                db = self._db()
+                db.execute("INSERT OR REPLACE INTO entries (file_id, version, text, size, last_access, offsets, unit) "
+                           "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                           (file_id, version, str(text), size, time.time(), packed, getattr(text, 'unit', None)))
+                self._evict(db)
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"[TEXT CACHE] Write error for {file_id}: {e}")
+
+    def _evict(self, db):
+        """Drop least-recently-used entries until the store fits its byte budget"""
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for file_id, size in db.execute(
+                "SELECT file_id, size FROM entries ORDER BY last_access ASC").fetchall():
+            if total <= self.max_bytes:
+                break
+            db.execute("DELETE FROM entries WHERE file_id = ?", (file_id,))
+            total -= size
+            self.evictions += 1
+
+    def invalidate(self, file_id):
+        """Forget any cached text for a file"""
+        with self._lock:
+            try:
+                db = self._db()
+                db.execute("DELETE FROM entries WHERE file_id = ?", (file_id,))
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"[TEXT CACHE] Delete error for {file_id}: {e}")
+
+    def quarantine(self, file_id, version, reason):
+        """Record a file revision that failed or hit extraction limits, so it isn't retried per query"""
+        if not file_id or not version:
+            return
+        with self._lock:
+            try:
+                db = self._db()
+                db.execute("INSERT OR REPLACE INTO quarantine (file_id, version, reason, recorded_at) "
+                           "VALUES (?, ?, ?, ?)", (file_id, version, reason, time.time()))
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"[TEXT CACHE] Quarantine error for {file_id}: {e}")
+
+    def quarantined(self, file_id, version):
+        """Reason this exact revision was quarantined, or None (a new revision is tried again)"""
+        if not file_id or not version:
+            return None
+        with self._lock:
+            try:
+                row = self._db().execute("SELECT reason FROM quarantine WHERE file_id = ? AND version = ?",
+                                         (file_id, version)).fetchone()
+                return row[0] if row else None
+            except sqlite3.Error as e:
+                print(f"[TEXT CACHE] Quarantine read error for {file_id}: {e}")
+                return None
+
+    def stats(self):
+        """Hit/miss/eviction counters plus current size, for sizing the cache"""
+        with self._lock:
+            entries, total, quarantined = 0, 0, 0
+            try:
+                entries, total = self._db().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+                quarantined = self._db().execute("SELECT COUNT(*) FROM quarantine").fetchone()[0]
+            except sqlite3.Error as e:
+                print(f"[TEXT CACHE] Stats error: {e}")
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': entries,
+                'bytes': total,
+                'max_bytes': self.max_bytes,
+                'quarantined': quarantined
+            }
+
+
+# Process-wide cache used by both apps
+text_cache = TextCache(
+    os.environ.get('TEXT_CACHE_DIR', DEFAULT_CACHE_DIR),
+    int(os.environ.get('TEXT_CACHE_MAX_MB', 200)) * 1024 * 1024
+)